@@ -1,6 +1,14 @@
+import os
 from app import create_app
+from app.services.job_queue import start_embedding_workers
 
 app = create_app()
 
 if __name__ == '__main__':
+    # The debug reloader serves from a child process (WERKZEUG_RUN_MAIN=true);
+    # the parent only watches files, so it must not run embedding workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_embedding_workers(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
+else:
+    start_embedding_workers(app)
@@ -15,15 +15,22 @@ def create_app():
     
     # Initialize extensions
     db.init_app(app)
-    CORS(app)
+    CORS(app, expose_headers=['Server-Timing'])
+    
+    from app.services.metrics import metrics
+    metrics.init_app(app)
     
     # Register blueprints
     from app.routes.documents import documents_bp
     from app.routes.chat import chat_bp
     from app.routes.organizations import organizations_bp
+    from app.routes.jobs import jobs_bp
+    from app.routes.metrics import metrics_bp
     
     app.register_blueprint(documents_bp, url_prefix='/api/documents')
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
     app.register_blueprint(organizations_bp, url_prefix='/api/organizations')
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+    app.register_blueprint(metrics_bp)
     
     return app
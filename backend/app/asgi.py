@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from a2wsgi import WSGIMiddleware
+from config import Config
+from app.routes.chat import process_query_async, stream_query_async
+from app.services.metrics import metrics
+
+
+class AsyncApp:
+    """ASGI application serving chat queries as coroutines.
+
+    POST /api/chat/query and /api/chat/query/stream are handled natively:
+    OpenAI calls go through the async client, so a waiting query holds no
+    thread, and database and index work runs on a pool of
+    Config.ASYNC_DB_THREADS threads, each call in its own app context.
+    Every other request is passed to the Flask app on a pool of
+    Config.ASYNC_FLASK_THREADS threads. The per-stage timings header is only
+    honoured there.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=Config.ASYNC_FLASK_THREADS)
+        self.executor = ThreadPoolExecutor(Config.ASYNC_DB_THREADS, thread_name_prefix='async-db')
+        self.routes = {
+            ('POST', '/api/chat/query'): process_query_async,
+            ('POST', '/api/chat/query/stream'): stream_query_async
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        try:
+            try:
+                data = json.loads(await self._body(receive) or b'null')
+            except ValueError:
+                payload, status = {'error': 'Request body must be JSON'}, 400
+            else:
+                payload, status = await handler(self.run, data)
+        except Exception as e:
+            payload = {'error': str(e)}
+        finally:
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                            endpoint=scope['path'], method=scope['method'], status=str(status))
+        if isinstance(payload, dict):
+            await self._send(send, scope, status, 'application/json', [json.dumps(payload).encode()])
+        else:
+            await self._send(send, scope, status, 'text/event-stream', (event.encode() async for event in payload),
+                             [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')])
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the database threads inside an app context"""
+        def call():
+            with self.flask_app.app_context():
+                return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    @staticmethod
+    async def _body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                return body
+
+    @staticmethod
+    async def _send(send, scope, status, content_type, chunks, headers=()):
+        headers = [(b'content-type', content_type.encode()), *headers]
+        # As Flask-CORS does for the routes it serves
+        if any(name == b'origin' for name, _ in scope['headers']):
+            headers += [(b'access-control-allow-origin', b'*'), (b'access-control-expose-headers', b'Server-Timing')]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        if isinstance(chunks, list):
+            await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+            return
+        async for chunk in chunks:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(flask_app=None):
+    """ASGI counterpart of create_app(), wrapping the Flask app it creates (or is given)"""
+    if flask_app is None:
+        from app import create_app
+        flask_app = create_app()
+    return AsyncApp(flask_app)
@@ -1,4 +1,6 @@
 from .organization import Organization
 from .document import Document
+from .document_chunk import DocumentChunk
+from .embedding_job import EmbeddingJob
 
-__all__ = ['Organization', 'Document']
+__all__ = ['Organization', 'Document', 'DocumentChunk', 'EmbeddingJob']
@@ -1,9 +1,53 @@
 from app import db
 from datetime import datetime
 import hashlib
+import json
+import struct
+import numpy as np
+
+# Binary embedding layout: 8-byte header (magic, dtype code, dimension)
+# followed by the raw little-endian vector. The header keeps the payload
+# 4-byte aligned so it can be decoded without copying.
+EMBEDDING_MAGIC = b'EMB'
+EMBEDDING_HEADER = struct.Struct('<3sBI')
+EMBEDDING_DTYPES = {1: np.dtype('<f4')}
+EMBEDDING_DTYPE_CODES = {dtype: code for code, dtype in EMBEDDING_DTYPES.items()}
+
+def content_hash(text):
+    """SHA-256 hex digest used for document dedupe and embedding cache keys"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def encode_embedding(embedding_vector, dtype='<f4'):
+    """Pack a 1-D vector into the binary embedding format"""
+    dtype = np.dtype(dtype)
+    vector = np.asarray(embedding_vector, dtype=dtype)
+    if vector.ndim != 1:
+        raise ValueError(f"Embedding must be one-dimensional, got shape {vector.shape}")
+    header = EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_DTYPE_CODES[dtype], len(vector))
+    return header + vector.tobytes()
+
+def decode_embedding(raw):
+    """Return a read-only NumPy view over a binary embedding, or None"""
+    if not raw:
+        return None
+    magic, dtype_code, dim = EMBEDDING_HEADER.unpack_from(raw)
+    if magic != EMBEDDING_MAGIC or dtype_code not in EMBEDDING_DTYPES:
+        raise ValueError("Unrecognized embedding encoding")
+    return np.frombuffer(raw, dtype=EMBEDDING_DTYPES[dtype_code], count=dim,
+                         offset=EMBEDDING_HEADER.size)
 
 class Document(db.Model):
     __tablename__ = 'documents'
+    __table_args__ = (
+        # Keyset pagination within an organization
+        db.Index('ix_documents_org_id_id', 'org_id', 'id'),
+        db.Index('ix_documents_org_id_created_at', 'org_id', 'created_at', 'id'),
+    )
+    
+    # Embedding status: searchable only once 'indexed'
+    PENDING = 'pending'
+    INDEXED = 'indexed'
+    FAILED = 'failed'
     
     id = db.Column(db.Integer, primary_key=True)
     org_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=False)
@@ -12,9 +56,18 @@ class Document(db.Model):
     hash = db.Column(db.String(64), nullable=False, unique=True)  # SHA-256 hash
     document_metadata = db.Column(db.JSON, default=dict)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    embedding_status = db.Column(db.String(16), nullable=False, default=INDEXED, server_default=INDEXED)
     
-    # Vector embedding for semantic search (using pgvector)
-    embedding = db.Column(db.Text)  # Will store JSON string of embedding vector
+    # Whole-document embedding from before chunked ingestion; search now uses
+    # DocumentChunk embeddings and migrate_db.py carries these over
+    embedding_vector = db.Column(db.LargeBinary)
+    # Legacy JSON embedding, emptied by migrate_db.py
+    embedding = db.Column(db.Text)
+    
+    chunks = db.relationship('DocumentChunk', backref='document', lazy=True,
+                             cascade='all, delete-orphan', order_by='DocumentChunk.chunk_index')
+    embedding_jobs = db.relationship('EmbeddingJob', backref='document', lazy=True,
+                                     cascade='all, delete-orphan')
     
     def __init__(self, org_id, title, content, document_metadata=None):
         self.org_id = org_id
@@ -24,27 +77,31 @@ class Document(db.Model):
         self.document_metadata = document_metadata or {}
     
     def _generate_hash(self, content):
-        return hashlib.sha256(content.encode()).hexdigest()
+        return content_hash(content)
     
     def set_embedding(self, embedding_vector):
-        """Set the embedding vector (list of floats)"""
-        import json
-        self.embedding = json.dumps(embedding_vector)
+        """Set the embedding vector (list of floats or array)"""
+        self.embedding_vector = encode_embedding(embedding_vector)
+        self.embedding = None
     
     def get_embedding(self):
-        """Get the embedding vector as a list of floats"""
+        """Get the embedding vector as a float32 array"""
+        if self.embedding_vector:
+            return decode_embedding(self.embedding_vector)
         if self.embedding:
-            import json
-            return json.loads(self.embedding)
+            return np.asarray(json.loads(self.embedding), dtype=np.float32)
         return None
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'org_id': self.org_id,
-            'title': self.title,
-            'content': self.content,
-            'hash': self.hash,
-            'document_metadata': self.document_metadata,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    # Fields to_dict can emit; listing loads only the requested columns
+    DICT_FIELDS = ('id', 'org_id', 'title', 'content', 'hash', 'document_metadata',
+                   'embedding_status', 'created_at')
+    
+    def to_dict(self, fields=None):
+        """Serialize the document, optionally limited to some of DICT_FIELDS"""
+        result = {}
+        for field in fields or self.DICT_FIELDS:
+            value = getattr(self, field)
+            if field == 'created_at':
+                value = value.isoformat() if value else None
+            result[field] = value
+        return result
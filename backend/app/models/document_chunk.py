@@ -0,0 +1,38 @@
+from config import Config
+from app import db
+from app.models.document import encode_embedding, decode_embedding
+
+class DocumentChunk(db.Model):
+    __tablename__ = 'document_chunks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False, index=True)
+    org_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=False, index=True)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    start_char = db.Column(db.Integer, nullable=False)
+    end_char = db.Column(db.Integer, nullable=False)
+    
+    # Chunk embedding, stored as raw float32 bytes, and the model that produced it
+    # (None for embeddings stored before models were recorded)
+    embedding_vector = db.Column(db.LargeBinary)
+    embedding_model = db.Column(db.String(64))
+    
+    def set_embedding(self, embedding_vector, model=Config.EMBEDDING_MODEL):
+        """Set the embedding vector (list of floats or array)"""
+        self.embedding_vector = encode_embedding(embedding_vector)
+        self.embedding_model = model
+    
+    def get_embedding(self):
+        """Get the embedding vector as a float32 array"""
+        return decode_embedding(self.embedding_vector)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'document_id': self.document_id,
+            'chunk_index': self.chunk_index,
+            'content': self.content,
+            'start_char': self.start_char,
+            'end_char': self.end_char
+        }
@@ -7,6 +7,7 @@ class Organization(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False, unique=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    vector_quantization = db.Column(db.String(16))  # None uses Config.VECTOR_QUANTIZATION
     
     # Relationships
     documents = db.relationship('Document', backref='organization', lazy=True, cascade='all, delete-orphan')
@@ -15,5 +16,6 @@ class Organization(db.Model):
         return {
             'id': self.id,
             'name': self.name,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'vector_quantization': self.vector_quantization
         }
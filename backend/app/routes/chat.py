@@ -1,50 +1,308 @@
-from flask import Blueprint, request, jsonify
-from app.services.rag_service import RAGService
+import asyncio
+import json
+import time
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from config import Config
+from app.services.answer_cache import answer_cache
+from app.services.metadata_filter import filter_conditions
+from app.services.metrics import metrics
+from app.services.rag_service import ERROR_RESPONSE, RAGService
 
 chat_bp = Blueprint('chat', __name__)
 
+NO_DOCUMENTS_RESPONSE = "I couldn't find any relevant documents to answer your question. Please make sure you have uploaded documents to this organization."
+
 @chat_bp.route('/query', methods=['POST'])
 def process_query():
     """Process user query with RAG-based response"""
     try:
-        data = request.get_json()
-        
-        if not data or 'query' not in data:
-            return jsonify({'error': 'Query is required'}), 400
-        
-        query = data['query']
-        org_id = data.get('org_id')
-        
-        if not org_id:
-            return jsonify({'error': 'Organization ID is required'}), 400
+        try:
+            query, org_id, mode, filters = _query_params(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Initialize RAG service
         rag_service = RAGService()
         
+        # Near-duplicate questions reuse a stored answer
+        query_embedding, version, cached = _cached_answer(rag_service, query, org_id, mode, filters)
+        if cached:
+            return jsonify({
+                'response': cached['response'],
+                'sources': cached['sources'],
+                'query': query,
+                'cached': True
+            }), 200
+        
         # Find relevant documents
-        relevant_docs = rag_service.find_relevant_documents(query, org_id)
+        relevant_docs = rag_service.find_relevant_documents(query, org_id, mode=mode, filters=filters)
         
         if not relevant_docs:
             return jsonify({
-                'response': "I couldn't find any relevant documents to answer your question. Please make sure you have uploaded documents to this organization.",
-                'sources': []
+                'response': NO_DOCUMENTS_RESPONSE,
+                'sources': [],
+                'cached': False
             }), 200
         
         # Generate response using RAG
         response = rag_service.generate_response(query, relevant_docs)
-        
-        # Prepare source information
-        sources = [{
-            'id': doc.id,
-            'title': doc.title,
-            'content_preview': doc.content[:200] + '...' if len(doc.content) > 200 else doc.content
-        } for doc in relevant_docs]
+        sources = _sources(relevant_docs)
+        if query_embedding is not None and response != ERROR_RESPONSE:
+            answer_cache.put(org_id, mode, query_embedding, version, response, sources)
         
         return jsonify({
             'response': response,
             'sources': sources,
-            'query': query
+            'query': query,
+            'cached': False,
+            'context': _context_report(rag_service)
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/query/stream', methods=['POST'])
+def stream_query():
+    """Process user query and stream the response as Server-Sent Events
+    
+    Emits a `sources` event once retrieval finishes, a `token` event per
+    completion delta, then `done` with timings (or `error`).
+    """
+    try:
+        try:
+            query, org_id, mode, filters = _query_params(request.get_json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        started = time.perf_counter()
+        rag_service = RAGService()
+        query_embedding, version, cached = _cached_answer(rag_service, query, org_id, mode, filters)
+        if cached:
+            relevant_docs = []
+            sources = cached['sources']
+        else:
+            relevant_docs = rag_service.find_relevant_documents(query, org_id, mode=mode, filters=filters)
+            sources = _sources(relevant_docs)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        
+        def events():
+            yield _sse('sources', {'sources': sources, 'query': query, 'cached': bool(cached)})
+            first_token_ms = None
+            streamed = []
+            try:
+                if cached:
+                    tokens = [cached['response']]
+                elif relevant_docs:
+                    tokens = rag_service.stream_response(query, relevant_docs)
+                else:
+                    tokens = [NO_DOCUMENTS_RESPONSE]
+                for token in tokens:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                    streamed.append(token)
+                    yield _sse('token', {'text': token})
+            except Exception as e:
+                print(f"Error streaming response: {e}")
+                yield _sse('error', {'error': ERROR_RESPONSE})
+                return
+            if relevant_docs and query_embedding is not None:
+                answer_cache.put(org_id, mode, query_embedding, version, ''.join(streamed), sources)
+            done = {
+                'retrieval_ms': round(retrieval_ms, 1),
+                'first_token_ms': round(first_token_ms, 1) if first_token_ms is not None else None,
+                'total_ms': round((time.perf_counter() - started) * 1000, 1),
+                'context': _context_report(rag_service)
+            }
+            if request.headers.get(Config.DEBUG_TIMINGS_HEADER):
+                done['stages'] = metrics.breakdown()
+            yield _sse('done', done)
+        
+        return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # stop nginx from buffering the stream
+        })
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@chat_bp.route('/cache', methods=['GET'])
+def answer_cache_stats():
+    """Answer cache size and hit rate"""
+    try:
+        return jsonify(answer_cache.stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+async def process_query_async(run, data):
+    """process_query() for the ASGI app; returns (payload, status)
+    
+    The query is embedded through the async OpenAI client while the
+    database work that does not need its embedding runs; ``run(fn, *args)``
+    runs database work on a worker thread in an app context.
+    """
+    try:
+        query, org_id, mode, filters = await run(_query_params, data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    rag_service = RAGService()
+    query_embedding, version, cached, relevant_docs = await _retrieve_async(run, rag_service, query, org_id,
+                                                                            mode, filters)
+    if cached:
+        return {
+            'response': cached['response'],
+            'sources': cached['sources'],
+            'query': query,
+            'cached': True
+        }, 200
+    if not relevant_docs:
+        return {
+            'response': NO_DOCUMENTS_RESPONSE,
+            'sources': [],
+            'cached': False
+        }, 200
+    
+    response = await rag_service.generate_response_async(query, relevant_docs)
+    sources = _sources(relevant_docs)
+    if query_embedding is not None and response != ERROR_RESPONSE:
+        answer_cache.put(org_id, mode, query_embedding, version, response, sources)
+    
+    return {
+        'response': response,
+        'sources': sources,
+        'query': query,
+        'cached': False,
+        'context': _context_report(rag_service)
+    }, 200
+
+async def stream_query_async(run, data):
+    """stream_query() for the ASGI app; returns (error payload, status) or (async SSE generator, 200)"""
+    try:
+        query, org_id, mode, filters = await run(_query_params, data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    
+    started = time.perf_counter()
+    rag_service = RAGService()
+    query_embedding, version, cached, relevant_docs = await _retrieve_async(run, rag_service, query, org_id,
+                                                                            mode, filters)
+    sources = cached['sources'] if cached else _sources(relevant_docs)
+    retrieval_ms = (time.perf_counter() - started) * 1000
+    
+    async def events():
+        yield _sse('sources', {'sources': sources, 'query': query, 'cached': bool(cached)})
+        first_token_ms = None
+        streamed = []
+        try:
+            if cached:
+                tokens = _aiter([cached['response']])
+            elif relevant_docs:
+                tokens = rag_service.stream_response_async(query, relevant_docs)
+            else:
+                tokens = _aiter([NO_DOCUMENTS_RESPONSE])
+            async for token in tokens:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                streamed.append(token)
+                yield _sse('token', {'text': token})
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield _sse('error', {'error': ERROR_RESPONSE})
+            return
+        if relevant_docs and query_embedding is not None:
+            answer_cache.put(org_id, mode, query_embedding, version, ''.join(streamed), sources)
+        yield _sse('done', {
+            'retrieval_ms': round(retrieval_ms, 1),
+            'first_token_ms': round(first_token_ms, 1) if first_token_ms is not None else None,
+            'total_ms': round((time.perf_counter() - started) * 1000, 1),
+            'context': _context_report(rag_service)
+        })
+    
+    return events(), 200
+
+async def _retrieve_async(run, rag_service, query, org_id, mode, filters):
+    """Embed the query while preparing retrieval, then consult the answer cache or rank documents
+    
+    Returns (query embedding, corpus version, cached answer, documents) like
+    _cached_answer() followed by find_relevant_documents().
+    """
+    use_cache = Config.ANSWER_CACHE_ENABLED and mode != 'lexical' and not filters
+    version = answer_cache.version(org_id)
+    limit = Config.MAX_CONTEXT_DOCUMENTS
+    try:
+        if mode == 'lexical':
+            scope = await run(rag_service.prepare_retrieval, query, [org_id], limit, mode, filters)
+            query_embedding = None
+        else:
+            scope, query_embedding = await asyncio.gather(
+                run(rag_service.prepare_retrieval, query, [org_id], limit, mode, filters),
+                rag_service.embed_query_async(query))
+        if use_cache and query_embedding is not None:
+            cached = answer_cache.get(org_id, mode, query_embedding)
+            if cached:
+                return query_embedding, version, cached, []
+        relevant_docs = await run(rag_service.rank_documents, query, [org_id], limit, mode, scope, query_embedding)
+    except Exception as e:
+        print(f"Error finding relevant documents: {e}")
+        return None, None, None, []
+    return (query_embedding if use_cache else None), version, None, relevant_docs
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+def _query_params(data):
+    """(query, org_id, mode, filters) of a chat request; raises ValueError for invalid ones"""
+    if not data or 'query' not in data:
+        raise ValueError('Query is required')
+    org_id = data.get('org_id')
+    if not org_id:
+        raise ValueError('Organization ID is required')
+    if isinstance(org_id, str) and org_id.strip().isdigit():
+        org_id = int(org_id)
+    if not isinstance(org_id, int) or isinstance(org_id, bool):
+        raise ValueError('Organization ID must be an integer')
+    mode = data.get('mode', Config.RETRIEVAL_MODE)
+    if mode not in Config.RETRIEVAL_MODES:
+        raise ValueError(f"mode must be one of: {', '.join(Config.RETRIEVAL_MODES)}")
+    filter_conditions(data.get('filters') or {})
+    return data['query'], org_id, mode, data.get('filters')
+
+def _cached_answer(rag_service, query, org_id, mode, filters=None):
+    """Look a query up in the answer cache
+    
+    Returns the query embedding and corpus version to store a fresh answer
+    under, and the cached answer or None. Lexical queries skip the cache so
+    they never call the embeddings API, and filtered queries skip it because
+    their answers come from a subset of the documents.
+    """
+    if not Config.ANSWER_CACHE_ENABLED or mode == 'lexical' or filters:
+        return None, None, None
+    # Read the version first so changes committed during generation win
+    version = answer_cache.version(org_id)
+    query_embedding = rag_service.embed_query(query)
+    if query_embedding is None:
+        return None, None, None
+    return query_embedding, version, answer_cache.get(org_id, mode, query_embedding)
+
+def _context_report(rag_service):
+    """Token usage of the prompt context, if one was built"""
+    if rag_service.context is None:
+        return None
+    return {key: value for key, value in rag_service.context.items() if key != 'context'}
+
+def _sources(relevant_docs):
+    """Source attribution for retrieved documents"""
+    return [{
+        'id': doc.id,
+        'title': doc.title,
+        'score': doc.score,
+        'content_preview': _preview(doc.relevant_chunks[0].content)
+    } for doc in relevant_docs]
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _preview(text, length=200):
+    return text[:length] + '...' if len(text) > length else text
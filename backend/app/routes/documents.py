@@ -1,8 +1,20 @@
-from flask import Blueprint, request, jsonify
+import base64
+import binascii
+import json
+from collections import Counter
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from sqlalchemy.orm import load_only
+from config import Config
 from app import db
 from app.models.document import Document
 from app.models.organization import Organization
-from app.services.embedding_service import EmbeddingService
+from app.models.document_chunk import DocumentChunk
+from app.services.ingestion_service import IngestionService
+from app.services import bulk_delete
+from app.services.job_queue import enqueue_embedding, notify_embedding_workers
+from app.services.metadata_filter import filter_conditions
+from app.services.vector_index import vector_index
 
 documents_bp = Blueprint('documents', __name__)
 
@@ -29,15 +41,28 @@ def upload_document():
             document_metadata=data.get('document_metadata', {})
         )
         
-        # Generate embedding
-        embedding_service = EmbeddingService()
-        embedding = embedding_service.generate_embedding(doc.content)
-        if embedding:
-            doc.set_embedding(embedding)
+        # Split into chunks; embed them now or queue them for the workers
+        ingestion = IngestionService()
+        job = None
+        chunks = []
+        if Config.ASYNC_EMBEDDING:
+            doc.chunks = ingestion.build_chunks(doc)
+            job = enqueue_embedding(doc)
+        else:
+            chunks = ingestion.ingest(doc)
         
         # Save to database
         db.session.add(doc)
         db.session.commit()
+        vector_index.add_chunks(doc.org_id, chunks)
+        
+        if job is not None:
+            notify_embedding_workers()
+            return jsonify({
+                'message': 'Document accepted; it becomes searchable once embedded',
+                'document': doc.to_dict(),
+                'job': job.to_dict()
+            }), 202
         
         return jsonify({
             'message': 'Document uploaded successfully',
@@ -48,33 +73,167 @@ def upload_document():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@documents_bp.route('/bulk', methods=['POST'])
+def bulk_upload_documents():
+    """Upload many documents to one organization
+    
+    Accepts a JSON body {"org_id": ..., "documents": [...]} or, with
+    Content-Type application/x-ndjson, one document per line and org_id
+    in the query string. Reports a status for every item.
+    """
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            org_id = request.args.get('org_id', type=int)
+            items = []
+            for line in request.stream:
+                if not line.strip():
+                    continue
+                if len(items) >= Config.BULK_MAX_DOCUMENTS:
+                    items.append(None)
+                    break
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+        else:
+            data = request.get_json() or {}
+            org_id = data.get('org_id')
+            items = data.get('documents')
+        
+        if not org_id or not isinstance(items, list):
+            return jsonify({'error': 'Missing required fields: org_id, documents'}), 400
+        if len(items) > Config.BULK_MAX_DOCUMENTS:
+            return jsonify({'error': f'At most {Config.BULK_MAX_DOCUMENTS} documents per request'}), 413
+        
+        # Check if organization exists
+        org = Organization.query.get(org_id)
+        if not org:
+            return jsonify({'error': 'Organization not found'}), 404
+        
+        results, indexed = IngestionService().ingest_many(org_id, items)
+        vector_index.add_vectors(org_id, [chunk_id for chunk_id, _ in indexed],
+                                 [vector for _, vector in indexed])
+        
+        return jsonify({
+            'message': 'Bulk upload processed',
+            'summary': dict(Counter(result['status'] for result in results)),
+            'results': results
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @documents_bp.route('/', methods=['GET'])
 def list_documents():
-    """List documents with optional organization filtering"""
+    """List documents with optional organization filtering
+    
+    Paginated by keyset: pass the returned `next_cursor` as `cursor` to get
+    the next `limit` documents in `order` (id or created_at). `fields` is a
+    comma-separated projection; unrequested columns are never loaded.
+    `stream=true` instead returns every match as one streamed JSON array.
+    """
     try:
         org_id = request.args.get('org_id', type=int)
+        order = request.args.get('order', 'id')
+        limit = min(request.args.get('limit', Config.DOCUMENTS_PAGE_SIZE, type=int), Config.DOCUMENTS_MAX_PAGE_SIZE)
+        stream = request.args.get('stream', 'false').lower() == 'true'
+        
+        if order not in ('id', 'created_at'):
+            return jsonify({'error': 'order must be id or created_at'}), 400
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        
+        fields = list(Document.DICT_FIELDS)
+        if request.args.get('fields'):
+            fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+            unknown = set(fields) - set(Document.DICT_FIELDS)
+            if unknown:
+                return jsonify({'error': f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+        
+        cursor = None
+        if request.args.get('cursor'):
+            try:
+                cursor = _decode_cursor(request.args['cursor'], order)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
         
         query = Document.query
         if org_id:
             query = query.filter_by(org_id=org_id)
+        # The keyset columns are always loaded so the next cursor can be built
+        columns = {'id', order} | set(fields)
+        query = query.options(load_only(*[getattr(Document, column) for column in columns]))
+        
+        if stream:
+            return Response(stream_with_context(_stream_documents(query, order, fields, cursor)),
+                            mimetype='application/json')
         
-        documents = query.all()
+        documents = _page(query, order, cursor, limit + 1)
+        next_cursor = _encode_cursor(documents[limit - 1], order) if len(documents) > limit else None
         
         return jsonify({
-            'documents': [doc.to_dict() for doc in documents]
+            'documents': [doc.to_dict(fields) for doc in documents[:limit]],
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _page(query, order, cursor, limit):
+    """One keyset page of documents after the cursor"""
+    if order == 'created_at':
+        if cursor is not None:
+            created_at, last_id = cursor
+            query = query.filter(db.or_(Document.created_at > created_at,
+                                        db.and_(Document.created_at == created_at, Document.id > last_id)))
+        query = query.order_by(Document.created_at, Document.id)
+    else:
+        if cursor is not None:
+            query = query.filter(Document.id > cursor)
+        query = query.order_by(Document.id)
+    return query.limit(limit).all()
+
+def _stream_documents(query, order, fields, cursor):
+    """Yield every matching document as a JSON array, one page in memory at a time"""
+    yield '['
+    first = True
+    while True:
+        documents = _page(query, order, cursor, Config.DOCUMENTS_MAX_PAGE_SIZE)
+        for doc in documents:
+            yield ('' if first else ',') + json.dumps(doc.to_dict(fields))
+            first = False
+        if len(documents) < Config.DOCUMENTS_MAX_PAGE_SIZE:
+            break
+        cursor = _decode_cursor(_encode_cursor(documents[-1], order), order)
+        # Release the page before loading the next one
+        db.session.expunge_all()
+    yield ']'
+
+def _encode_cursor(doc, order):
+    key = [doc.created_at.isoformat(), doc.id] if order == 'created_at' else doc.id
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def _decode_cursor(cursor, order):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if order == 'created_at':
+            return datetime.fromisoformat(key[0]), int(key[1])
+        return int(key)
+    except (TypeError, ValueError, IndexError, binascii.Error):
+        raise ValueError('Invalid cursor')
+
 @documents_bp.route('/<int:doc_id>', methods=['DELETE'])
 def delete_document(doc_id):
     """Delete a document"""
     try:
         doc = Document.query.get_or_404(doc_id)
+        org_id = doc.org_id
+        chunk_ids = _chunk_ids(doc_id)
         
         db.session.delete(doc)
         db.session.commit()
+        vector_index.remove_chunks(org_id, chunk_ids)
         
         return jsonify({'message': 'Document deleted successfully'}), 200
         
@@ -82,6 +241,54 @@ def delete_document(doc_id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@documents_bp.route('/bulk/delete', methods=['POST'])
+def bulk_delete_documents():
+    """Delete an organization's documents by `ids`, metadata `filters`, or both
+    
+    Documents go in batches of Config.DELETE_BATCH_SIZE, one transaction
+    each. `stream=true` reports progress as newline-delimited JSON.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'org_id' not in data:
+            return jsonify({'error': 'Organization ID is required'}), 400
+        try:
+            org_id = _org_id(data['org_id'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if db.session.get(Organization, org_id) is None:
+            return jsonify({'error': 'Organization not found'}), 404
+        
+        ids = data.get('ids')
+        filters = data.get('filters')
+        stream = request.args.get('stream', 'false').lower() == 'true'
+        
+        if ids is None and not filters:
+            return jsonify({'error': 'Provide ids or filters; delete the organization to remove all its documents'}), 400
+        if ids is not None and not (isinstance(ids, list) and all(isinstance(doc_id, int) for doc_id in ids)):
+            return jsonify({'error': 'ids must be a list of document IDs'}), 400
+        try:
+            conditions = filter_conditions(filters or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        deletion = bulk_delete.delete_documents([Document.org_id == org_id, *conditions], ids)
+        if stream:
+            lines = bulk_delete.progress_lines(deletion, 'Documents deleted successfully')
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+        progress = bulk_delete.run(deletion)
+        
+        return jsonify({
+            'message': 'Documents deleted successfully',
+            'deleted': progress['deleted'],
+            'chunks': progress['chunks']
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @documents_bp.route('/<int:doc_id>', methods=['PUT'])
 def update_document(doc_id):
     """Update a document"""
@@ -93,20 +300,36 @@ def update_document(doc_id):
             return jsonify({'error': 'No data provided'}), 400
         
         # Update fields
+        old_chunk_ids = []
+        chunks = []
+        job = None
         if 'title' in data:
             doc.title = data['title']
         if 'content' in data:
             doc.content = data['content']
-            # Regenerate hash and embedding for content changes
+            # Regenerate hash and chunk embeddings for content changes
             doc.hash = doc._generate_hash(doc.content)
-            embedding_service = EmbeddingService()
-            embedding = embedding_service.generate_embedding(doc.content)
-            if embedding:
-                doc.set_embedding(embedding)
+            old_chunk_ids = _chunk_ids(doc_id)
+            ingestion = IngestionService()
+            if Config.ASYNC_EMBEDDING:
+                doc.chunks = ingestion.build_chunks(doc)
+                job = enqueue_embedding(doc)
+            else:
+                chunks = ingestion.ingest(doc)
         if 'document_metadata' in data:
             doc.document_metadata = data['document_metadata']
         
         db.session.commit()
+        vector_index.remove_chunks(doc.org_id, old_chunk_ids)
+        vector_index.add_chunks(doc.org_id, chunks)
+        
+        if job is not None:
+            notify_embedding_workers()
+            return jsonify({
+                'message': 'Document updated; new content becomes searchable once embedded',
+                'document': doc.to_dict(),
+                'job': job.to_dict()
+            }), 202
         
         return jsonify({
             'message': 'Document updated successfully',
@@ -119,7 +342,7 @@ def update_document(doc_id):
 
 @documents_bp.route('/search', methods=['POST'])
 def search_documents():
-    """Semantic search for documents"""
+    """Hybrid keyword and semantic search for documents"""
     try:
         data = request.get_json()
         
@@ -128,25 +351,123 @@ def search_documents():
         
         query_text = data['query']
         org_id = data.get('org_id')
+        org_ids = data.get('org_ids')
+        limit = data.get('limit', Config.MAX_CONTEXT_DOCUMENTS)
+        mode = data.get('mode', Config.RETRIEVAL_MODE)
+        filters = data.get('filters')
+        
+        if org_ids is not None and not isinstance(org_ids, list):
+            return jsonify({'error': 'org_ids must be a list'}), 400
+        try:
+            limit = _search_limit(limit)
+            if org_id:
+                org_id = _org_id(org_id)
+            if org_ids is not None:
+                org_ids = [_org_id(item) for item in org_ids]
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if mode not in Config.RETRIEVAL_MODES:
+            return jsonify({'error': f"mode must be one of: {', '.join(Config.RETRIEVAL_MODES)}"}), 400
+        try:
+            filter_conditions(filters or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Use RAG service to find relevant documents
         from app.services.rag_service import RAGService
         rag_service = RAGService()
         
         if org_id:
-            relevant_docs = rag_service.find_relevant_documents(query_text, org_id)
+            relevant_docs = rag_service.find_relevant_documents(query_text, org_id, limit, mode, filters)
         else:
-            # Search across all organizations if no org_id specified
-            relevant_docs = []
-            orgs = Organization.query.all()
-            for org in orgs:
-                docs = rag_service.find_relevant_documents(query_text, org.id)
-                relevant_docs.extend(docs)
+            # Rank across all organizations, or the org_ids allow-list
+            relevant_docs = rag_service.find_relevant_documents_global(query_text, org_ids, limit, mode, filters)
         
         return jsonify({
             'query': query_text,
-            'results': [doc.to_dict() for doc in relevant_docs]
+            'results': [_search_result(doc, doc.score, doc.relevant_chunks) for doc in relevant_docs]
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@documents_bp.route('/search/batch', methods=['POST'])
+def search_documents_batch():
+    """Search one organization with many queries at once
+    
+    All queries are embedded in one API call and scored together, which is
+    far faster than one /search request per query.
+    """
+    try:
+        data = request.get_json()
+        
+        if not data or 'org_id' not in data or 'queries' not in data:
+            return jsonify({'error': 'Missing required fields: org_id, queries'}), 400
+        
+        queries = data['queries']
+        org_id = data['org_id']
+        limit = data.get('limit', Config.MAX_CONTEXT_DOCUMENTS)
+        mode = data.get('mode', Config.RETRIEVAL_MODE)
+        filters = data.get('filters')
+        
+        if not isinstance(queries, list) or not all(isinstance(query, str) and query for query in queries):
+            return jsonify({'error': 'queries must be a list of non-empty strings'}), 400
+        if len(queries) > Config.SEARCH_BATCH_MAX_QUERIES:
+            return jsonify({'error': f'At most {Config.SEARCH_BATCH_MAX_QUERIES} queries per request'}), 413
+        try:
+            org_id = _org_id(org_id)
+            limit = _search_limit(limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if mode not in Config.RETRIEVAL_MODES:
+            return jsonify({'error': f"mode must be one of: {', '.join(Config.RETRIEVAL_MODES)}"}), 400
+        try:
+            filter_conditions(filters or {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        from app.services.rag_service import RAGService
+        batches = RAGService().find_relevant_documents_batch(queries, org_id, limit, mode, filters)
+        
+        return jsonify({
+            'results': [{
+                'query': query_text,
+                'results': [_search_result(doc, score, chunks) for doc, score, chunks in ranked]
+            } for query_text, ranked in zip(queries, batches)]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _org_id(value):
+    """An organization ID from a request body as int; raises ValueError unless it is an integer"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise ValueError('Organization IDs must be integers')
+
+def _search_limit(value):
+    """A search request's result limit as int; raises ValueError unless it is within 1..Config.SEARCH_MAX_LIMIT"""
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= Config.SEARCH_MAX_LIMIT:
+        raise ValueError(f'limit must be an integer from 1 to {Config.SEARCH_MAX_LIMIT}')
+    return value
+
+def _chunk_ids(doc_id):
+    """Ids of a document's chunks, without loading their content"""
+    return [chunk_id for chunk_id, in
+            DocumentChunk.query.with_entities(DocumentChunk.id).filter_by(document_id=doc_id)]
+
+def _search_result(doc, score, chunks):
+    """Serialize a retrieved document with its score and matching passages"""
+    result = doc.to_dict()
+    result['score'] = score
+    result['passages'] = [{
+        'chunk_index': chunk.chunk_index,
+        'content': chunk.content,
+        'start_char': chunk.start_char,
+        'end_char': chunk.end_char
+    } for chunk in chunks]
+    return result
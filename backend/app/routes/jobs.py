@@ -0,0 +1,17 @@
+from flask import Blueprint, jsonify
+from app.models.embedding_job import EmbeddingJob
+
+jobs_bp = Blueprint('jobs', __name__)
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status of an embedding job"""
+    try:
+        job = EmbeddingJob.query.get(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        result = job.to_dict()
+        result['document_status'] = job.document.embedding_status
+        return jsonify({'job': result}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,33 @@
+from flask import Blueprint, Response
+from app.services.answer_cache import answer_cache
+from app.services.embedding_cache import embedding_cache
+from app.services.metrics import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Counters, stage latency histograms and cache statistics in Prometheus text format"""
+    try:
+        embedding = embedding_cache.stats()
+        answers = answer_cache.stats()
+        extra = [
+            ('embedding_cache_lookups_total', 'counter', 'Embedding cache lookups by result', [
+                ({'result': 'hit_memory'}, embedding['hits_memory']),
+                ({'result': 'hit_disk'}, embedding['hits_disk']),
+                ({'result': 'miss'}, embedding['misses'])
+            ]),
+            ('embedding_cache_hit_rate', 'gauge', 'Share of embedding lookups served from cache', [({}, embedding['hit_rate'])]),
+            ('embedding_cache_memory_entries', 'gauge', 'Vectors held in the in-process embedding cache',
+             [({}, embedding['memory_entries'])]),
+            ('answer_cache_lookups_total', 'counter', 'Answer cache lookups by result', [
+                ({'result': 'hit'}, answers['hits']),
+                ({'result': 'miss'}, answers['misses'])
+            ]),
+            ('answer_cache_hit_rate', 'gauge', 'Share of chat queries answered from cache', [({}, answers['hit_rate'])]),
+            ('answer_cache_entries', 'gauge', 'Answers held in the answer cache', [({}, answers['entries'])])
+        ]
+        return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+        
+    except Exception as e:
+        return Response(f'# error: {e}\n', status=500, mimetype='text/plain')
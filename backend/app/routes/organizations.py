@@ -1,6 +1,13 @@
-from flask import Blueprint, request, jsonify
+import io
+import tempfile
+import time
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from app import db
 from app.models.organization import Organization
+from config import Config
+from app.services import bulk_delete
+from app.services.corpus_transfer import export_organization, import_organization
+from app.services.vector_index import vector_index
 
 organizations_bp = Blueprint('organizations', __name__)
 
@@ -52,17 +59,116 @@ def get_organization(org_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@organizations_bp.route('/<int:org_id>', methods=['DELETE'])
-def delete_organization(org_id):
-    """Delete an organization and all its documents"""
+@organizations_bp.route('/<int:org_id>', methods=['PUT'])
+def update_organization(org_id):
+    """Update an organization's settings"""
     try:
         org = Organization.query.get_or_404(org_id)
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        rebuild_index = False
+        if 'vector_quantization' in data:
+            quantization = data['vector_quantization']
+            if quantization is not None and quantization not in Config.VECTOR_QUANTIZATION_MODES:
+                return jsonify({'error': f"vector_quantization must be null or one of {', '.join(Config.VECTOR_QUANTIZATION_MODES)}"}), 400
+            rebuild_index = quantization != org.vector_quantization
+            org.vector_quantization = quantization
         
-        # Delete organization (documents will be deleted due to cascade)
-        db.session.delete(org)
         db.session.commit()
+        if rebuild_index:
+            vector_index.reset(org_id)
+        
+        return jsonify({
+            'message': 'Organization updated successfully',
+            'organization': org.to_dict()
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@organizations_bp.route('/<int:org_id>/index', methods=['GET'])
+def get_organization_index(org_id):
+    """Get the size and memory footprint of an organization's vector index"""
+    try:
+        Organization.query.get_or_404(org_id)
+        return jsonify({'index': vector_index.stats(org_id)}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@organizations_bp.route('/<int:org_id>/export', methods=['GET'])
+def export_organization_corpus(org_id):
+    """Download an organization's documents and embeddings as an .npz file"""
+    try:
+        Organization.query.get_or_404(org_id)
+        file = tempfile.TemporaryFile()
+        export_organization(org_id, file)
+        file.seek(0)
+        return send_file(file, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=f'organization_{org_id}.npz')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@organizations_bp.route('/<int:org_id>/import', methods=['POST'])
+def import_organization_corpus(org_id):
+    """Load an exported .npz file into an organization without re-embedding
+    
+    Accepts the file as the multipart field ``file`` or as the raw request
+    body. Documents whose content already exists in the organization are
+    skipped; an export with documents of other organizations is refused,
+    since content is unique across the database. Chunks
+    without an embedding from Config.EMBEDDING_MODEL are counted in
+    ``unindexed_chunks``; they are not searchable until backfill_embeddings.py
+    re-embeds them.
+    """
+    try:
+        Organization.query.get_or_404(org_id)
+        if 'file' in request.files:
+            file = request.files['file'].stream
+        else:
+            file = io.BytesIO(request.get_data())
+        
+        started = time.perf_counter()
+        try:
+            result = import_organization(org_id, file)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        
+        return jsonify({'message': 'Import completed', **result}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@organizations_bp.route('/<int:org_id>', methods=['DELETE'])
+def delete_organization(org_id):
+    """Delete an organization and all its documents
+    
+    Documents go in batches of Config.DELETE_BATCH_SIZE, one transaction
+    each. `stream=true` reports progress as newline-delimited JSON.
+    """
+    try:
+        Organization.query.get_or_404(org_id)
+        stream = request.args.get('stream', 'false').lower() == 'true'
+        
+        deletion = bulk_delete.delete_organization(org_id)
+        if stream:
+            lines = bulk_delete.progress_lines(deletion, 'Organization deleted successfully')
+            return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+        progress = bulk_delete.run(deletion)
         
-        return jsonify({'message': 'Organization deleted successfully'}), 200
+        return jsonify({
+            'message': 'Organization deleted successfully',
+            'deleted': progress['deleted'],
+            'chunks': progress['chunks']
+        }), 200
         
     except Exception as e:
         db.session.rollback()
@@ -1,4 +1,5 @@
 from .embedding_service import EmbeddingService
 from .rag_service import RAGService
+from .vector_index import VectorIndex, vector_index
 
-__all__ = ['EmbeddingService', 'RAGService']
+__all__ = ['EmbeddingService', 'RAGService', 'VectorIndex', 'vector_index']
@@ -0,0 +1,362 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+from config import Config
+from .vector_index import VectorIndex
+
+OP_UPSERT = 1
+OP_DELETE = 2
+
+
+def assign_lists(vectors, centroids, batch_size=8192):
+    """Return the index of the nearest centroid for each unit vector"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        block = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        assignments[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, nlist, iterations=20, seed=0):
+    """Spherical k-means over unit vectors, returning unit-length centroids"""
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > nlist * 256:
+        sample = vectors[np.sort(rng.choice(len(vectors), nlist * 256, replace=False))]
+    sample = np.asarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_lists(sample, centroids)
+        counts = np.bincount(assignments, minlength=nlist)
+        nonempty = counts > 0
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        centroids[nonempty] = VectorIndex.normalize(sums)
+    return centroids
+
+
+def recall_at_k(index, exact, queries, k, **search_kwargs):
+    """Fraction of the exact top-k that the approximate index also returns"""
+    found = 0
+    expected = 0
+    for query in queries:
+        truth = {item_id for item_id, _ in exact.search(query, k)}
+        approx = {item_id for item_id, _ in index.search(query, k, **search_kwargs)}
+        found += len(truth & approx)
+        expected += len(truth)
+    return found / expected if expected else 1.0
+
+
+class IVFIndex:
+    """Inverted-file approximate index persisted to memory-mapped files.
+
+    Vectors are clustered around ``nlist`` k-means centroids and stored
+    contiguously per cluster; a search scores only the ``nprobe`` clusters
+    nearest the query. The clustered base lives in ``<path>/<version>/*.npy``
+    and is opened with ``mmap_mode='r'``, so a restarted worker serves queries
+    straight from the page cache.
+
+    Inserts and deletes after the base was written go to an in-memory exact
+    delta plus tombstones, and are appended to ``<path>/wal.bin`` so they
+    survive restarts. Once they exceed ``Config.IVF_COMPACT_RATIO`` of the
+    base, the live vectors are re-clustered into a new version on a
+    background thread, without holding the lock; changes logged meanwhile
+    are carried over to the new version's log when it is switched in.
+    """
+
+    def __init__(self, path, nlist=None, nprobe=None):
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dim = None
+        self._version = None
+        self._centroids = None
+        self._vectors = None
+        self._ids = None
+        self._offsets = None
+        self._base_ids = np.empty(0, dtype=np.int64)
+        self._delta = VectorIndex()
+        self._deleted = set()
+        self._deleted_array = None
+        self._compacting = False
+        self._closed = False
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'CURRENT'))
+
+    @classmethod
+    def open(cls, path, nlist=None, nprobe=None):
+        """Map a persisted index and replay its write-ahead log"""
+        index = cls(path, nlist, nprobe)
+        with open(os.path.join(path, 'CURRENT')) as f:
+            index._load_version(f.read().strip())
+        index._replay_wal()
+        return index
+
+    @classmethod
+    def create(cls, path, ids, vectors, nlist=None, nprobe=None):
+        """Cluster the given vectors and persist them as a new index"""
+        index = cls(path, nlist, nprobe)
+        if len(ids):
+            vectors = VectorIndex.normalize(vectors)
+            index.dim = vectors.shape[1]
+            index._switch_version(index._build_version(np.asarray(ids, dtype=np.int64), vectors))
+        return index
+
+    def close(self):
+        """Keep a running background compaction from switching in its version once the index is discarded"""
+        with self._lock:
+            self._closed = True
+
+    def __len__(self):
+        return len(self._base_ids) - len(self._deleted) + len(self._delta)
+
+    def __contains__(self, item_id):
+        return item_id in self._delta or (self._in_base([item_id])[0] and item_id not in self._deleted)
+
+    def checksum(self):
+        """Return (count, sum of ids) of live entries for comparison with the database"""
+        with self._lock:
+            delta_ids, _ = self._delta.snapshot()
+            total = int(self._base_ids.sum()) - sum(self._deleted) + int(delta_ids.sum())
+            return len(self), total
+
+    def _wal_dtype(self):
+        return np.dtype([('id', '<i8'), ('op', 'u1'), ('vector', '<f4', (self.dim,))])
+
+    def _in_base(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._base_ids) == 0:
+            return np.zeros(len(ids), dtype=bool)
+        positions = np.searchsorted(self._base_ids, ids)
+        positions[positions == len(self._base_ids)] = 0
+        return self._base_ids[positions] == ids
+
+    def _load_version(self, version):
+        directory = os.path.join(self.path, version)
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.dim = meta['dim']
+        self._version = version
+        self._centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self._offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        mmap_mode = 'r' if meta['count'] else None
+        self._vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode=mmap_mode)
+        self._ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode)
+        self._base_ids = np.sort(self._ids)
+        self._delta = VectorIndex(self.dim)
+        self._deleted = set()
+        self._deleted_array = None
+
+    def _wal_path(self):
+        return os.path.join(self.path, 'wal.bin')
+
+    def _build_version(self, ids, vectors):
+        """Cluster vectors into a new version directory and return its name, without switching to it"""
+        count = len(ids)
+        nlist = self.nlist or Config.IVF_NLIST or int(np.sqrt(count))
+        if count < Config.IVF_MIN_TRAIN_SIZE:
+            nlist = 1
+        nlist = max(1, min(nlist, count))
+        if nlist > 1:
+            centroids = train_centroids(vectors, nlist)
+            assignments = assign_lists(vectors, centroids)
+        else:
+            centroids = np.zeros((1, self.dim), dtype=np.float32)
+            assignments = np.zeros(count, dtype=np.int64)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=nlist)))).astype(np.int64)
+
+        version = f'v{time.time_ns()}'
+        directory = os.path.join(self.path, version)
+        os.makedirs(directory)
+        np.save(os.path.join(directory, 'centroids.npy'), centroids)
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'vectors.npy'), np.ascontiguousarray(vectors[order], dtype=np.float32))
+        np.save(os.path.join(directory, 'ids.npy'), ids[order])
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'dim': self.dim, 'nlist': nlist, 'count': count}, f)
+        return version
+
+    def _switch_version(self, version, wal=b''):
+        """Make a built version current, with ``wal`` as the records logged since its snapshot"""
+        # Replaying the old log onto the new base yields the same entries, so
+        # a crash between switching CURRENT and replacing the log is harmless
+        wal_path = self._wal_path()
+        with open(wal_path + '.tmp', 'wb') as f:
+            f.write(wal)
+        current = os.path.join(self.path, 'CURRENT')
+        with open(current + '.tmp', 'w') as f:
+            f.write(version)
+        os.replace(current + '.tmp', current)
+        os.replace(wal_path + '.tmp', wal_path)
+
+        previous = self._version
+        self._load_version(version)
+        if wal:
+            self._replay_wal()
+        if previous:
+            shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+
+    def _append_wal(self, ids, op, vectors=None):
+        records = np.zeros(len(ids), dtype=self._wal_dtype())
+        records['id'] = ids
+        records['op'] = op
+        if vectors is not None:
+            records['vector'] = vectors
+        with open(self._wal_path(), 'ab') as f:
+            f.write(records.tobytes())
+
+    def _replay_wal(self):
+        wal_path = self._wal_path()
+        if not os.path.exists(wal_path):
+            return
+        dtype = self._wal_dtype()
+        # A torn final record from a crash is ignored
+        count = os.path.getsize(wal_path) // dtype.itemsize
+        records = np.fromfile(wal_path, dtype=dtype, count=count)
+        latest = {}
+        for position, item_id in enumerate(records['id'].tolist()):
+            latest[item_id] = position
+        positions = np.fromiter(latest.values(), dtype=np.int64, count=len(latest))
+        upserts = positions[records['op'][positions] == OP_UPSERT]
+        deletes = positions[records['op'][positions] == OP_DELETE]
+        if len(upserts):
+            self._apply_upsert(records['id'][upserts], records['vector'][upserts])
+        if len(deletes):
+            self._apply_remove(records['id'][deletes])
+
+    def _tombstone(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self._deleted.update(ids[self._in_base(ids)].tolist())
+        self._deleted_array = None
+
+    def _apply_upsert(self, ids, vectors):
+        self._tombstone(ids)
+        self._delta.add([int(item_id) for item_id in ids], vectors)
+
+    def _apply_remove(self, ids):
+        self._tombstone(ids)
+        self._delta.remove([int(item_id) for item_id in ids])
+
+    def _maybe_compact(self):
+        if self._compacting or self._closed:
+            return
+        pending = len(self._delta) + len(self._deleted)
+        if pending > max(Config.IVF_MIN_TRAIN_SIZE, Config.IVF_COMPACT_RATIO * len(self._base_ids)):
+            self._compacting = True
+            threading.Thread(target=self._compact_in_background, name='ivf-compaction', daemon=True).start()
+
+    def _live(self):
+        """Copies of the ids and vectors of every live entry"""
+        live = ~np.isin(self._ids, np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)))
+        delta_ids, delta_vectors = self._delta.snapshot()
+        ids = np.concatenate([np.asarray(self._ids)[live], delta_ids])
+        vectors = np.concatenate([np.asarray(self._vectors)[live], delta_vectors.reshape(-1, self.dim)])
+        return ids, vectors
+
+    def compact(self):
+        """Re-cluster all live vectors into a fresh on-disk version"""
+        with self._lock:
+            self._switch_version(self._build_version(*self._live()))
+
+    def _compact_in_background(self):
+        """compact() with the clustering outside the lock, so searches and writes continue meanwhile"""
+        try:
+            with self._lock:
+                if self._closed:
+                    return
+                ids, vectors = self._live()
+                base_version = self._version
+                wal_offset = os.path.getsize(self._wal_path())
+            version = self._build_version(ids, vectors)
+            with self._lock:
+                if self._closed or self._version != base_version:
+                    # Discarded, or compacted synchronously meanwhile
+                    shutil.rmtree(os.path.join(self.path, version), ignore_errors=True)
+                    if self._closed:
+                        try:
+                            os.rmdir(self.path)  # only if the build recreated it empty
+                        except OSError:
+                            pass
+                    return
+                with open(self._wal_path(), 'rb') as f:
+                    f.seek(wal_offset)
+                    wal = f.read()
+                self._switch_version(version, wal)
+        except Exception as e:
+            print(f"Vector index compaction failed for {self.path}: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def add(self, ids, vectors):
+        """Insert or replace the vectors for the given ids"""
+        vectors = VectorIndex.normalize(vectors)
+        with self._lock:
+            if self._version is None:
+                self.dim = vectors.shape[1]
+                self._switch_version(self._build_version(np.empty(0, dtype=np.int64),
+                                                         np.empty((0, self.dim), dtype=np.float32)))
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+            ids = np.asarray(ids, dtype=np.int64)
+            self._append_wal(ids, OP_UPSERT, vectors)
+            self._apply_upsert(ids, vectors)
+            self._maybe_compact()
+
+    def remove(self, ids):
+        """Drop the given ids"""
+        with self._lock:
+            if self._version is None:
+                return
+            ids = np.asarray(ids, dtype=np.int64)
+            self._append_wal(ids, OP_DELETE)
+            self._apply_remove(ids)
+            self._maybe_compact()
+
+    def search(self, query_embedding, k, threshold=None, nprobe=None):
+        """Return up to k approximate (id, score) pairs ordered by cosine similarity"""
+        query = VectorIndex.normalize(query_embedding)[0]
+        nprobe = nprobe or self.nprobe or Config.IVF_NPROBE
+        with self._lock:
+            if k <= 0 or self._version is None:
+                return []
+            hits = self._delta.search(query, k)
+            nlist = len(self._centroids)
+            if len(self._base_ids):
+                if nprobe < nlist:
+                    lists = np.argpartition(self._centroids @ query, -nprobe)[-nprobe:]
+                else:
+                    lists = np.arange(nlist)
+                candidate_ids = []
+                candidate_scores = []
+                for list_no in lists:
+                    start, end = self._offsets[list_no], self._offsets[list_no + 1]
+                    if start < end:
+                        candidate_ids.append(self._ids[start:end])
+                        candidate_scores.append(self._vectors[start:end] @ query)
+                if candidate_ids:
+                    ids = np.concatenate(candidate_ids)
+                    scores = np.concatenate(candidate_scores)
+                    if self._deleted:
+                        if self._deleted_array is None:
+                            self._deleted_array = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))
+                        live = ~np.isin(ids, self._deleted_array)
+                        ids, scores = ids[live], scores[live]
+                    if k < len(scores):
+                        top = np.argpartition(scores, -k)[-k:]
+                    else:
+                        top = np.arange(len(scores))
+                    hits.extend((int(ids[row]), float(scores[row])) for row in top)
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        hits = hits[:k]
+        if threshold is not None:
+            hits = [(item_id, score) for item_id, score in hits if score >= threshold]
+        return hits
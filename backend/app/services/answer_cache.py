@@ -0,0 +1,106 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from config import Config
+from .vector_index import VectorIndex, vector_index
+
+
+class AnswerCache:
+    """Recent chat answers per organization, matched by query similarity.
+
+    A query whose embedding has cosine similarity of at least ``threshold``
+    with a stored query (same organization and retrieval mode) gets the
+    stored answer and sources. Entries remember the organization's corpus
+    version and are dropped once it changes, so any committed document
+    change invalidates them. Size is bounded by LRU eviction across all
+    organizations, and entries expire after ``ttl_seconds``.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, threshold):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries = OrderedDict()  # least recently used first
+        self._by_org = {}
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, org_id):
+        """Corpus version to pass to put(); read it before retrieval starts"""
+        return vector_index.version(org_id)
+
+    def get(self, org_id, mode, query_embedding):
+        """Return {'response', 'sources', 'similarity'} for a near-duplicate query, or None"""
+        org_id = int(org_id)
+        query = VectorIndex.normalize(query_embedding)[0]
+        with self._lock:
+            self._expire(org_id)
+            keys = [key for key in self._by_org.get(org_id, ())
+                    if self._entries[key]['mode'] == mode and self._entries[key]['vector'].shape == query.shape]
+            if keys:
+                scores = np.stack([self._entries[key]['vector'] for key in keys]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    entry = self._entries[keys[best]]
+                    return {'response': entry['response'], 'sources': entry['sources'],
+                            'similarity': float(scores[best])}
+            self.misses += 1
+            return None
+
+    def put(self, org_id, mode, query_embedding, version, response, sources):
+        """Store an answer computed against corpus ``version``"""
+        org_id = int(org_id)
+        with self._lock:
+            if version != vector_index.version(org_id):
+                return  # the corpus changed while the answer was generated
+            key = next(self._keys)
+            self._entries[key] = {
+                'org_id': org_id,
+                'mode': mode,
+                'vector': VectorIndex.normalize(query_embedding)[0],
+                'version': version,
+                'created_at': time.monotonic(),
+                'response': response,
+                'sources': sources
+            }
+            self._by_org.setdefault(org_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _expire(self, org_id):
+        version = vector_index.version(org_id)
+        oldest = time.monotonic() - self.ttl_seconds
+        for key in list(self._by_org.get(org_id, ())):
+            entry = self._entries[key]
+            if entry['version'] != version or entry['created_at'] < oldest:
+                self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key)
+        keys = self._by_org[entry['org_id']]
+        keys.discard(key)
+        if not keys:
+            del self._by_org[entry['org_id']]
+
+    def stats(self):
+        """Hit/miss counters since the process started"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self._entries)
+        }
+
+
+answer_cache = AnswerCache(
+    Config.ANSWER_CACHE_MAX_ENTRIES,
+    Config.ANSWER_CACHE_TTL_SECONDS,
+    Config.ANSWER_CACHE_SIMILARITY
+)
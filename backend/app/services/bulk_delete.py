@@ -0,0 +1,118 @@
+import json
+from config import Config
+from app import db
+from app.models.document import Document
+from app.models.document_chunk import DocumentChunk
+from app.models.embedding_job import EmbeddingJob
+from app.models.organization import Organization
+from .vector_index import vector_index
+
+
+def _count(conditions, ids, batch_size):
+    if ids is None:
+        return db.session.query(db.func.count(Document.id)).filter(*conditions).scalar()
+    total = 0
+    for start in range(0, len(ids), batch_size):
+        total += (db.session.query(db.func.count(Document.id))
+                  .filter(Document.id.in_(ids[start:start + batch_size]), *conditions)
+                  .scalar())
+    return total
+
+
+def _batches(conditions, ids, batch_size):
+    """(id, org_id) rows of the matching documents, at most batch_size at a time in id order"""
+    if ids is not None:
+        for start in range(0, len(ids), batch_size):
+            rows = (db.session.query(Document.id, Document.org_id)
+                    .filter(Document.id.in_(ids[start:start + batch_size]), *conditions)
+                    .all())
+            if rows:
+                yield rows
+        return
+    last_id = 0
+    while True:
+        rows = (db.session.query(Document.id, Document.org_id)
+                .filter(Document.id > last_id, *conditions)
+                .order_by(Document.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def delete_documents(conditions, ids=None, batch_size=Config.DELETE_BATCH_SIZE):
+    """Delete the documents matching SQLAlchemy conditions (and among ``ids`` if given)
+
+    Works a batch of documents per transaction with set-based DELETEs of
+    their embedding jobs, chunks and rows, reading nothing but ids, so
+    memory and the database write lock are bounded by one batch. Removed
+    chunks leave the resident vector indexes after each commit; the FTS
+    triggers keep the lexical index in step. A generator: yields
+    {'deleted', 'chunks', 'total'} after every committed batch.
+    """
+    if ids is not None:
+        ids = sorted(set(ids))
+    total = _count(conditions, ids, batch_size)
+    deleted = 0
+    chunks = 0
+    for rows in _batches(conditions, ids, batch_size):
+        document_ids = [doc_id for doc_id, _ in rows]
+        chunk_rows = (db.session.query(DocumentChunk.id, DocumentChunk.org_id)
+                      .filter(DocumentChunk.document_id.in_(document_ids))
+                      .all())
+        for model, column in ((EmbeddingJob, EmbeddingJob.document_id),
+                              (DocumentChunk, DocumentChunk.document_id),
+                              (Document, Document.id)):
+            db.session.execute(db.delete(model).where(column.in_(document_ids))
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+
+        removed = {org_id: [] for _, org_id in rows}
+        for chunk_id, org_id in chunk_rows:
+            removed.setdefault(org_id, []).append(chunk_id)
+        for org_id, chunk_ids in removed.items():
+            vector_index.remove_chunks(org_id, chunk_ids)
+        deleted += len(document_ids)
+        chunks += len(chunk_rows)
+        yield {'deleted': deleted, 'chunks': chunks, 'total': total}
+
+
+def delete_organization(org_id, batch_size=Config.DELETE_BATCH_SIZE):
+    """Delete an organization's documents in batches, then the organization itself
+
+    Yields progress like delete_documents; the organization row and its
+    vector index go after the last batch.
+    """
+    yield from delete_documents([Document.org_id == org_id], batch_size=batch_size)
+    db.session.execute(db.delete(Organization).where(Organization.id == org_id)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    vector_index.drop_organization(org_id)
+
+
+def run(deletion):
+    """Run a deletion generator to the end and return its final progress"""
+    progress = {'deleted': 0, 'chunks': 0, 'total': 0}
+    for progress in deletion:
+        pass
+    return progress
+
+
+def progress_lines(deletion, message):
+    """Newline-delimited JSON of a deletion's progress, ending with ``message`` and the totals
+
+    A failure ends the stream with an ``error`` line; batches committed
+    before it stay deleted, so the request can simply be repeated.
+    """
+    progress = {'deleted': 0, 'chunks': 0, 'total': 0}
+    try:
+        for progress in deletion:
+            yield json.dumps(progress) + '\n'
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error deleting documents: {e}")
+        yield json.dumps({**progress, 'error': str(e)}) + '\n'
+        return
+    yield json.dumps({**progress, 'message': message}) + '\n'
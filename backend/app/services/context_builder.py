@@ -0,0 +1,147 @@
+import math
+import re
+from config import Config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n{2,}')
+WORD_END = re.compile(r'\s+')
+
+
+class TokenCounter:
+    """Counts tokens with the chat model's tiktoken encoding.
+
+    Without tiktoken (or its encoding files) it estimates
+    ``CHARS_PER_TOKEN`` characters per token, which errs on the high side
+    for English text.
+    """
+
+    CHARS_PER_TOKEN = 3.5
+
+    def __init__(self, model=Config.CHAT_MODEL):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encoding = tiktoken.get_encoding(Config.TOKENIZER_FALLBACK_ENCODING)
+            except Exception as e:
+                print(f"Tokenizer unavailable, estimating token counts: {e}")
+
+    def count(self, text):
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.CHARS_PER_TOKEN)
+
+
+_default_counter = None
+
+
+def default_counter():
+    """Process-wide counter for the chat model, loaded on first use"""
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+
+class ContextBuilder:
+    """Fits the best passages of ranked documents into a token budget.
+
+    Passages are taken round-robin by rank: the best chunk of every
+    document first, then each document's second best, and so on. Repeated
+    passages are skipped. The first passage that does not fit is cut at the
+    last sentence boundary that does, or the last word boundary when no
+    whole sentence fits, and filling stops there. A passage of which not
+    even a word fits is skipped and filling continues with the next ones.
+    """
+
+    def __init__(self, budget=Config.CONTEXT_TOKEN_BUDGET, counter=None):
+        self.budget = budget
+        self.counter = counter or default_counter()
+
+    def build(self, relevant_documents):
+        """Return {'context', 'tokens', 'budget', 'passages', 'truncated'}"""
+        queues = [self._candidates(doc) for doc in relevant_documents]
+        selected = {}  # document position -> [(reading order, text)]
+        headers = {}
+        seen = set()
+        used = 0
+        passages = 0
+        truncated = False
+        full = False
+        depth = 0
+        while not full and any(depth < len(queue) for queue in queues):
+            for position, queue in enumerate(queues):
+                if depth >= len(queue):
+                    continue
+                order, text = queue[depth]
+                key = ' '.join(text.split()).lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+                header = 0
+                if position not in headers:
+                    header = self.counter.count(self._header(len(headers) + 1, relevant_documents[position]))
+                cost = header + self.counter.count(text)
+                if used + cost > self.budget:
+                    text = self._truncate(text, self.budget - used - header)
+                    truncated = True
+                    if not text:
+                        continue
+                    full = True
+                    cost = header + self.counter.count(text)
+                if position not in headers:
+                    headers[position] = len(headers) + 1
+                selected.setdefault(position, []).append((order, text))
+                used += cost
+                passages += 1
+                if full:
+                    break
+            depth += 1
+
+        context = ""
+        for position in sorted(selected, key=headers.get):
+            doc = relevant_documents[position]
+            texts = [text for _, text in sorted(selected[position])]
+            context += self._header(headers[position], doc) + "\n...\n".join(texts) + "\n\n"
+        return {
+            'context': context,
+            'tokens': self.counter.count(context),
+            'budget': self.budget,
+            'passages': passages,
+            'truncated': truncated
+        }
+
+    def _candidates(self, doc):
+        """(reading order, text) of a document's passages, best first"""
+        chunks = getattr(doc, 'relevant_chunks', None)
+        if not chunks:
+            return [(0, doc.content.strip())]
+        return [(chunk.chunk_index, chunk.content.strip()) for chunk in chunks]
+
+    def _header(self, number, doc):
+        return f"Document {number}: {doc.title}\n"
+
+    def _truncate(self, text, budget):
+        """Longest prefix of whole sentences within budget tokens, else of whole words"""
+        if budget <= 0:
+            return ""
+        return (self._prefix(text, SENTENCE_END, budget)
+                or self._prefix(text, WORD_END, budget))
+
+    def _prefix(self, text, boundary, budget):
+        """Longest prefix ending at a ``boundary`` match within budget tokens"""
+        ends = [match.start() for match in boundary.finditer(text)]
+        low, high = 0, len(ends)
+        # Token counts grow with the prefix, so binary search the cut
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.counter.count(text[:ends[middle - 1]]) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:ends[low - 1]] if low else ""
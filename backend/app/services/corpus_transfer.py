@@ -0,0 +1,231 @@
+import json
+import zipfile
+from datetime import datetime
+import numpy as np
+from config import Config
+from app import db
+from app.models.document import Document, content_hash, decode_embedding, encode_embedding
+from app.models.document_chunk import DocumentChunk
+from app.models.organization import Organization
+from .vector_index import vector_index
+
+# Export file layout: an uncompressed .npz with the document text and
+# metadata as one UTF-8 JSON array and the chunks as parallel columns,
+# including a float32 block of their embeddings. Chunk text is not stored
+# twice; it is sliced from the document content by its character span.
+FORMAT = 'celeritas-corpus'
+FORMAT_VERSION = 1
+
+
+def export_organization(org_id, file):
+    """Write an organization's documents, chunks and embeddings to ``file`` as .npz
+
+    Returns the number of documents and chunks written.
+    """
+    org = db.session.get(Organization, org_id)
+    documents = []
+    chunk_document = []
+    chunk_index = []
+    chunk_spans = []
+    chunk_models = []
+    vectors = []
+    models = []
+    dims = set()
+    last_id = 0
+    while True:
+        docs = (Document.query
+                .with_entities(Document.id, Document.title, Document.content,
+                               Document.document_metadata, Document.created_at)
+                .filter(Document.org_id == org_id, Document.id > last_id)
+                .order_by(Document.id)
+                .limit(Config.DOCUMENTS_MAX_PAGE_SIZE)
+                .all())
+        if not docs:
+            break
+        positions = {}
+        for doc in docs:
+            positions[doc.id] = len(documents)
+            documents.append({
+                'title': doc.title,
+                'content': doc.content,
+                'document_metadata': doc.document_metadata or {},
+                'created_at': doc.created_at.isoformat() if doc.created_at else None
+            })
+        chunks = (DocumentChunk.query
+                  .with_entities(DocumentChunk.document_id, DocumentChunk.chunk_index, DocumentChunk.start_char,
+                                 DocumentChunk.end_char, DocumentChunk.embedding_model, DocumentChunk.embedding_vector)
+                  .filter(DocumentChunk.document_id.in_(list(positions)))
+                  .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+                  .all())
+        for chunk in chunks:
+            chunk_document.append(positions[chunk.document_id])
+            chunk_index.append(chunk.chunk_index)
+            chunk_spans.append((chunk.start_char, chunk.end_char))
+            vector = decode_embedding(chunk.embedding_vector)
+            if vector is None:
+                chunk_models.append(-1)
+            else:
+                if chunk.embedding_model not in models:
+                    models.append(chunk.embedding_model)
+                chunk_models.append(models.index(chunk.embedding_model))
+                dims.add(len(vector))
+            vectors.append(vector)
+        last_id = docs[-1].id
+
+    if len(dims) > 1:
+        raise ValueError("Chunk embeddings have different dimensions; run backfill_embeddings.py first")
+    dim = dims.pop() if dims else 0
+    embeddings = np.zeros((len(vectors), dim), dtype=np.float32)
+    for row, vector in enumerate(vectors):
+        if vector is not None:
+            embeddings[row] = vector
+
+    metadata = {
+        'format': FORMAT,
+        'version': FORMAT_VERSION,
+        'organization': org.name if org else None,
+        'exported_at': datetime.utcnow().isoformat(),
+        'embedding_models': models,
+        'documents': documents
+    }
+    np.savez(file,
+             metadata=np.frombuffer(json.dumps(metadata).encode(), dtype=np.uint8),
+             chunk_document=np.array(chunk_document, dtype=np.int64),
+             chunk_index=np.array(chunk_index, dtype=np.int32),
+             chunk_spans=np.array(chunk_spans, dtype=np.int64).reshape(-1, 2),
+             chunk_model=np.array(chunk_models, dtype=np.int16),
+             embeddings=embeddings)
+    return {'documents': len(documents), 'chunks': len(vectors)}
+
+
+def read_export(file):
+    """Load an export file into (metadata, arrays), checking its format"""
+    try:
+        with np.load(file, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        metadata = json.loads(arrays.pop('metadata').tobytes())
+    except (AttributeError, EOFError, KeyError, OSError, ValueError, zipfile.BadZipFile):
+        raise ValueError("Not an organization export file")
+    if metadata.get('format') != FORMAT or metadata.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported export format {metadata.get('format')} v{metadata.get('version')}")
+    return metadata, arrays
+
+
+def import_organization(org_id, file):
+    """Bulk-load an export file into an organization without calling the embeddings API
+
+    Documents whose content hash already exists in the organization, or
+    earlier in the file, are skipped. Content hashes are unique across the
+    database, so an import that contains documents of other organizations
+    raises ValueError before writing anything; an organization can be copied
+    to another database but not cloned within one. Documents are inserted in transactions
+    of Config.BULK_INSERT_BATCH_SIZE and their embeddings added to the vector
+    index after each commit. Chunks embedded with a model other than
+    Config.EMBEDDING_MODEL are stored but, like the registry does, left out
+    of the index, and their documents marked failed, until
+    backfill_embeddings.py re-embeds them.
+    Returns counts of imported and skipped documents, imported chunks and
+    unindexed chunks.
+    """
+    metadata, arrays = read_export(file)
+    documents = metadata['documents']
+    models = metadata['embedding_models']
+    # Chunks from these models can share the index with the organization's current ones
+    indexable = {position for position, model in enumerate(models) if model in (None, Config.EMBEDDING_MODEL)}
+    embeddings = arrays['embeddings']
+    if len(embeddings) and embeddings.shape[1]:
+        _check_dimension(org_id, embeddings.shape[1])
+
+    # Chunk rows of each document, relying on the export's document order
+    bounds = np.searchsorted(arrays['chunk_document'], np.arange(len(documents) + 1))
+    hashes = [content_hash(doc['content']) for doc in documents]
+    existing = set()
+    elsewhere = 0
+    for start in range(0, len(hashes), Config.BULK_INSERT_BATCH_SIZE):
+        rows = (db.session.query(Document.hash, Document.org_id)
+                .filter(Document.hash.in_(hashes[start:start + Config.BULK_INSERT_BATCH_SIZE])))
+        for text_hash, owner in rows:
+            existing.add(text_hash)
+            elsewhere += owner != org_id
+    if elsewhere:
+        raise ValueError(f"{elsewhere} documents in the export already belong to other organizations; "
+                         f"document content is unique across the database, so import into another database")
+
+    selected = []
+    for position, text_hash in enumerate(hashes):
+        if text_hash in existing:
+            continue
+        existing.add(text_hash)
+        selected.append(position)
+
+    imported_chunks = 0
+    unindexed_chunks = 0
+    for start in range(0, len(selected), Config.BULK_INSERT_BATCH_SIZE):
+        group = selected[start:start + Config.BULK_INSERT_BATCH_SIZE]
+        document_rows = []
+        for position in group:
+            doc = documents[position]
+            chunk_models = arrays['chunk_model'][bounds[position]:bounds[position + 1]]
+            embedded = len(chunk_models) > 0 and all(int(model) in indexable for model in chunk_models)
+            document_rows.append({
+                'org_id': org_id,
+                'title': doc['title'],
+                'content': doc['content'],
+                'hash': hashes[position],
+                'document_metadata': doc['document_metadata'],
+                'created_at': datetime.fromisoformat(doc['created_at']) if doc['created_at'] else datetime.utcnow(),
+                'embedding_status': Document.INDEXED if embedded else Document.FAILED
+            })
+        document_ids = db.session.scalars(
+            db.insert(Document).returning(Document.id, sort_by_parameter_order=True), document_rows).all()
+
+        chunk_rows = []
+        sources = []
+        for position, document_id in zip(group, document_ids):
+            content = documents[position]['content']
+            for row in range(bounds[position], bounds[position + 1]):
+                start_char, end_char = (int(value) for value in arrays['chunk_spans'][row])
+                model = int(arrays['chunk_model'][row])
+                chunk_rows.append({
+                    'document_id': document_id,
+                    'org_id': org_id,
+                    'chunk_index': int(arrays['chunk_index'][row]),
+                    'content': content[start_char:end_char],
+                    'start_char': start_char,
+                    'end_char': end_char,
+                    'embedding_vector': encode_embedding(embeddings[row]) if model >= 0 else None,
+                    'embedding_model': models[model] if model >= 0 else None
+                })
+                sources.append(row)
+                if model not in indexable:
+                    unindexed_chunks += 1
+        chunk_ids = []
+        if chunk_rows:
+            chunk_ids = db.session.scalars(
+                db.insert(DocumentChunk).returning(DocumentChunk.id, sort_by_parameter_order=True), chunk_rows).all()
+        db.session.commit()
+
+        indexed = [(chunk_id, row) for chunk_id, row, chunk in zip(chunk_ids, sources, chunk_rows)
+                   if int(arrays['chunk_model'][row]) in indexable]
+        vector_index.add_vectors(org_id, [chunk_id for chunk_id, _ in indexed],
+                                 embeddings[[row for _, row in indexed]])
+        imported_chunks += len(chunk_rows)
+
+    return {
+        'imported': len(selected),
+        'skipped': len(documents) - len(selected),
+        'chunks': imported_chunks,
+        'unindexed_chunks': unindexed_chunks,
+        'embedding_models': models
+    }
+
+
+def _check_dimension(org_id, dim):
+    """Refuse embeddings that could not share an index with the organization's current ones"""
+    raw = (db.session.query(DocumentChunk.embedding_vector)
+           .filter(DocumentChunk.org_id == org_id, DocumentChunk.embedding_vector.isnot(None))
+           .limit(1)
+           .scalar())
+    current = decode_embedding(raw)
+    if current is not None and len(current) != dim:
+        raise ValueError(f"Export has {dim}-dimensional embeddings, organization {org_id} uses {len(current)}")
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from app.models.document import encode_embedding, decode_embedding
+
+
+class EmbeddingCache:
+    """Two-tier embedding cache keyed by (model, SHA-256 of the text).
+
+    The first tier is an in-process LRU of decoded vectors. The second is a
+    local SQLite file shared by every worker on the host; it is trimmed to
+    ``disk_max_entries`` by least-recent use. Both tiers are optional.
+    """
+
+    def __init__(self, memory_max_entries, disk_path=None, disk_max_entries=0):
+        self.memory_max_entries = memory_max_entries
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()
+        self._connection = None
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+    def _disk(self):
+        if self._connection is None and self.disk_path:
+            os.makedirs(os.path.dirname(self.disk_path), exist_ok=True)
+            connection = sqlite3.connect(self.disk_path, check_same_thread=False, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash))''')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)')
+            self._connection = connection
+        return self._connection
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model, text_hashes):
+        """Return cached vectors for the hashes, with None where missing"""
+        found = [None] * len(text_hashes)
+        with self._lock:
+            missing = []
+            for i, text_hash in enumerate(text_hashes):
+                vector = self._memory.get((model, text_hash))
+                if vector is not None:
+                    self._memory.move_to_end((model, text_hash))
+                    found[i] = vector
+                    self.hits_memory += 1
+                else:
+                    missing.append(i)
+
+            disk = self._disk()
+            if disk is not None and missing:
+                wanted = list({text_hashes[i] for i in missing})
+                rows = {}
+                # Stay well under SQLite's bound-parameter limit
+                for start in range(0, len(wanted), 500):
+                    batch = wanted[start:start + 500]
+                    placeholders = ','.join('?' * len(batch))
+                    rows.update(disk.execute(
+                        f'SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})',
+                        [model] + batch))
+                if rows:
+                    disk.executemany('UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?',
+                                     [(time.time(), model, text_hash) for text_hash in rows])
+                    disk.commit()
+                still_missing = []
+                for i in missing:
+                    raw = rows.get(text_hashes[i])
+                    if raw is None:
+                        still_missing.append(i)
+                        continue
+                    vector = decode_embedding(raw)
+                    self._remember((model, text_hashes[i]), vector)
+                    found[i] = vector
+                    self.hits_disk += 1
+                missing = still_missing
+
+            self.misses += len(missing)
+        return found
+
+    def get(self, model, text_hash):
+        return self.get_many(model, [text_hash])[0]
+
+    def put_many(self, model, text_hashes, vectors):
+        """Store vectors in both tiers"""
+        with self._lock:
+            for text_hash, vector in zip(text_hashes, vectors):
+                self._remember((model, text_hash), vector)
+            disk = self._disk()
+            if disk is None:
+                return
+            now = time.time()
+            disk.executemany('INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)',
+                             [(model, text_hash, encode_embedding(vector), now)
+                              for text_hash, vector in zip(text_hashes, vectors)])
+            self._disk_writes += len(text_hashes)
+            # Trimming needs a COUNT, so only check every few hundred writes
+            if self._disk_writes >= 256:
+                self._disk_writes = 0
+                (count,) = disk.execute('SELECT COUNT(*) FROM embeddings').fetchone()
+                excess = count - self.disk_max_entries
+                if excess > 0:
+                    disk.execute('DELETE FROM embeddings WHERE rowid IN '
+                                 '(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)', (excess,))
+            disk.commit()
+
+    def put(self, model, text_hash, vector):
+        self.put_many(model, [text_hash], [vector])
+
+    def stats(self):
+        """Hit/miss counters since the process started"""
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            'hits_memory': self.hits_memory,
+            'hits_disk': self.hits_disk,
+            'misses': self.misses,
+            'hit_rate': (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory)
+        }
+
+
+embedding_cache = EmbeddingCache(
+    Config.EMBEDDING_CACHE_MEMORY_ENTRIES,
+    Config.EMBEDDING_CACHE_PATH,
+    Config.EMBEDDING_CACHE_DISK_ENTRIES
+)
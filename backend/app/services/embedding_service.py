@@ -1,31 +1,69 @@
-import openai
+import asyncio
+import numpy as np
 from config import Config
-import json
+from app.models.document import content_hash
+from .embedding_cache import embedding_cache
+from .metrics import metrics
+from .openai_client import openai_client
 
 class EmbeddingService:
-    def __init__(self):
-        openai.api_key = Config.OPENAI_API_KEY
-    
-    def generate_embedding(self, text):
+    def _request_embeddings(self, texts):
+        """Call the embeddings API for a list of texts"""
+        response = openai_client.create_embeddings(texts)
+        return [np.asarray(data.embedding, dtype=np.float32) for data in response.data]
+
+    async def _request_embeddings_async(self, texts):
+        response = await openai_client.create_embeddings_async(texts)
+        return [np.asarray(data.embedding, dtype=np.float32) for data in response.data]
+
+    def generate_embedding(self, text, text_hash=None):
         """Generate embedding for a single text"""
+        embeddings = self.generate_embeddings_batch([text], [text_hash] if text_hash else None)
+        return embeddings[0] if embeddings else None
+
+    def generate_embeddings_batch(self, texts, text_hashes=None):
+        """Generate embeddings for multiple texts
+
+        Cached texts are served from the embedding cache; the rest are sent to
+        the API once each. ``text_hashes`` may carry precomputed SHA-256
+        digests, such as ``Document.hash``.
+        """
         try:
-            response = openai.embeddings.create(
-                model=Config.EMBEDDING_MODEL,
-                input=text
-            )
-            return response.data[0].embedding
+            hashes = text_hashes or [content_hash(text) for text in texts]
+            with metrics.span('embedding_cache'):
+                embeddings = embedding_cache.get_many(Config.EMBEDDING_MODEL, hashes)
+
+            # Identical texts in one batch are requested only once
+            missing = {}
+            for text, text_hash, embedding in zip(texts, hashes, embeddings):
+                if embedding is None:
+                    missing.setdefault(text_hash, text)
+            if missing:
+                with metrics.span('embedding_api'):
+                    fetched = dict(zip(missing, self._request_embeddings(list(missing.values()))))
+                embedding_cache.put_many(Config.EMBEDDING_MODEL, list(fetched), list(fetched.values()))
+                embeddings = [fetched[text_hash] if embedding is None else embedding
+                              for text_hash, embedding in zip(hashes, embeddings)]
+            return embeddings
         except Exception as e:
-            print(f"Error generating embedding: {e}")
+            print(f"Error generating batch embeddings: {e}")
             return None
-    
-    def generate_embeddings_batch(self, texts):
-        """Generate embeddings for multiple texts"""
+
+    async def generate_embedding_async(self, text):
+        """generate_embedding() for coroutines, calling the API without blocking the event loop
+
+        The embedding cache is read and written on worker threads, since its
+        disk tier is SQLite.
+        """
         try:
-            response = openai.embeddings.create(
-                model=Config.EMBEDDING_MODEL,
-                input=texts
-            )
-            return [data.embedding for data in response.data]
+            text_hash = content_hash(text)
+            with metrics.span('embedding_cache'):
+                embedding = await asyncio.to_thread(embedding_cache.get, Config.EMBEDDING_MODEL, text_hash)
+            if embedding is None:
+                with metrics.span('embedding_api'):
+                    embedding = (await self._request_embeddings_async([text]))[0]
+                await asyncio.to_thread(embedding_cache.put, Config.EMBEDDING_MODEL, text_hash, embedding)
+            return embedding
         except Exception as e:
-            print(f"Error generating batch embeddings: {e}")
+            print(f"Error generating embedding: {e}")
             return None
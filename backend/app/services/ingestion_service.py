@@ -0,0 +1,172 @@
+from config import Config
+from app import db
+from app.models.document import Document, content_hash
+from app.models.document_chunk import DocumentChunk
+from .embedding_service import EmbeddingService
+
+# Preferred break points, strongest first
+BOUNDARIES = ('\n\n', '. ', '? ', '! ', '\n', ' ')
+
+def split_text(text, chunk_size=Config.CHUNK_SIZE, overlap=Config.CHUNK_OVERLAP):
+    """Split text into overlapping (start, end) character spans.
+
+    Each span ends at the strongest boundary found in the back half of its
+    window, and the next span starts ``overlap`` characters earlier at a
+    word boundary.
+    """
+    spans = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            for boundary in BOUNDARIES:
+                cut = text.rfind(boundary, start + chunk_size // 2, end)
+                if cut != -1:
+                    end = cut + len(boundary)
+                    break
+        spans.append((start, end))
+        if end >= length:
+            break
+        next_start = end - overlap
+        space = text.find(' ', next_start, end)
+        if space != -1:
+            next_start = space + 1
+        start = max(next_start, start + 1)
+    return spans
+
+class IngestionService:
+    def __init__(self):
+        self.embedding_service = EmbeddingService()
+
+    def build_chunks(self, doc):
+        """Split a document's content into unsaved DocumentChunk rows"""
+        spans = [(start, end) for start, end in split_text(doc.content, Config.CHUNK_SIZE, Config.CHUNK_OVERLAP)
+                 if doc.content[start:end].strip()]
+        if not spans:
+            spans = [(0, len(doc.content))]
+        return [DocumentChunk(
+            org_id=doc.org_id,
+            chunk_index=i,
+            content=doc.content[start:end],
+            start_char=start,
+            end_char=end
+        ) for i, (start, end) in enumerate(spans)]
+
+    def batches(self, chunks):
+        """Group chunks (or any rows with ``content``) into embedding requests capped by count and characters"""
+        batch = []
+        chars = 0
+        for chunk in chunks:
+            if batch and (len(batch) >= Config.EMBEDDING_BATCH_SIZE
+                          or chars + len(chunk.content) > Config.EMBEDDING_BATCH_MAX_CHARS):
+                yield batch
+                batch = []
+                chars = 0
+            batch.append(chunk)
+            chars += len(chunk.content)
+        if batch:
+            yield batch
+
+    def embed_chunks(self, chunks):
+        """Embed chunks in size-capped batches; returns how many received an embedding"""
+        embedded = 0
+        for batch in self.batches(chunks):
+            embeddings = self.embedding_service.generate_embeddings_batch([chunk.content for chunk in batch])
+            if not embeddings:
+                continue
+            for chunk, embedding in zip(batch, embeddings):
+                chunk.set_embedding(embedding)
+                embedded += 1
+        return embedded
+
+    def ingest(self, doc):
+        """Replace a document's chunks with freshly split and embedded ones"""
+        chunks = self.build_chunks(doc)
+        self.embed_chunks(chunks)
+        doc.chunks = chunks
+        self.update_status(doc)
+        return chunks
+
+    @staticmethod
+    def update_status(doc):
+        """Mark a document indexed only if every chunk has an embedding"""
+        embedded = all(chunk.embedding_vector is not None for chunk in doc.chunks)
+        doc.embedding_status = Document.INDEXED if embedded else Document.FAILED
+
+    def ingest_many(self, org_id, items):
+        """Bulk-create documents for one organization
+
+        Items are deduplicated by content hash within the batch and against the
+        database, embedded together in size-capped batches, and inserted in
+        transactions of Config.BULK_INSERT_BATCH_SIZE documents. Returns one
+        result per item (in input order) and the committed (chunk_id, vector)
+        pairs for the vector index.
+        """
+        results = [None] * len(items)
+        pending = []
+        seen = {}
+        for i, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get('title') or not isinstance(item.get('content'), str):
+                results[i] = {'index': i, 'status': 'invalid', 'error': 'Missing required fields: title, content'}
+                continue
+            text_hash = content_hash(item['content'])
+            if text_hash in seen:
+                results[i] = {'index': i, 'status': 'duplicate', 'duplicate_of_index': seen[text_hash]}
+                continue
+            seen[text_hash] = i
+            pending.append((i, text_hash, item))
+
+        # Drop content that is already stored, looking hashes up in bounded IN lists
+        existing = {}
+        hashes = [text_hash for _, text_hash, _ in pending]
+        for start in range(0, len(hashes), Config.BULK_INSERT_BATCH_SIZE):
+            rows = (Document.query
+                    .with_entities(Document.hash, Document.id)
+                    .filter(Document.hash.in_(hashes[start:start + Config.BULK_INSERT_BATCH_SIZE])))
+            existing.update(rows)
+        docs = []
+        for i, text_hash, item in pending:
+            if text_hash in existing:
+                results[i] = {'index': i, 'status': 'duplicate', 'document_id': existing[text_hash]}
+                continue
+            doc = Document(
+                org_id=org_id,
+                title=item['title'],
+                content=item['content'],
+                document_metadata=item.get('document_metadata', {})
+            )
+            doc.chunks = self.build_chunks(doc)
+            docs.append((i, doc))
+
+        # One pass over all chunks lets small documents share embedding requests
+        self.embed_chunks([chunk for _, doc in docs for chunk in doc.chunks])
+        for _, doc in docs:
+            self.update_status(doc)
+
+        indexed = []
+        for start in range(0, len(docs), Config.BULK_INSERT_BATCH_SIZE):
+            group = docs[start:start + Config.BULK_INSERT_BATCH_SIZE]
+            try:
+                db.session.add_all([doc for _, doc in group])
+                # Read generated ids before commit expires the instances
+                db.session.flush()
+                created = [(i, {
+                    'index': i,
+                    'status': 'created',
+                    'document_id': doc.id,
+                    'chunks': len(doc.chunks),
+                    'embedded': doc.embedding_status == Document.INDEXED
+                }) for i, doc in group]
+                vectors = [(chunk.id, chunk.get_embedding()) for _, doc in group
+                           for chunk in doc.chunks if chunk.embedding_vector is not None]
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                for i, _ in group:
+                    results[i] = {'index': i, 'status': 'failed', 'error': str(e)}
+                continue
+            for i, result in created:
+                results[i] = result
+            indexed.extend(vectors)
+        return results, indexed
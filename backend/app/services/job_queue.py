@@ -0,0 +1,194 @@
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from config import Config
+from app import db
+from app.models.document import Document
+from app.models.embedding_job import EmbeddingJob
+from .ingestion_service import IngestionService
+from .vector_index import vector_index
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # the one-pool lock is not enforced on Windows
+
+
+def enqueue_embedding(doc):
+    """Mark a document as pending and add an embedding job to the session
+
+    The caller commits; the job row is what makes the work durable.
+    """
+    doc.embedding_status = Document.PENDING
+    job = EmbeddingJob(status=EmbeddingJob.QUEUED, attempts=0, run_after=datetime.utcnow())
+    doc.embedding_jobs.append(job)
+    return job
+
+
+class EmbeddingWorkerPool:
+    """Background threads that embed the chunks of queued documents.
+
+    Jobs live in the embedding_jobs table, so queued work survives restarts.
+    A worker claims a job with a conditional UPDATE and adds the embedded
+    chunks to this process's vector index, which other processes never see,
+    so the pool must run in the one process serving searches. Failed
+    attempts are retried with jittered exponential backoff until
+    EMBEDDING_JOB_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, app, workers=Config.EMBEDDING_WORKERS, poll_interval=Config.EMBEDDING_JOB_POLL_SECONDS):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        with self.app.app_context():
+            self._requeue_stale()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'embedding-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        """Wake idle workers after new jobs are committed"""
+        self._wakeup.set()
+
+    def _requeue_stale(self):
+        """Return jobs left running by a crashed process to the queue"""
+        lease_expired = datetime.utcnow() - timedelta(seconds=Config.EMBEDDING_JOB_LEASE_SECONDS)
+        requeued = (EmbeddingJob.query
+                    .filter(EmbeddingJob.status == EmbeddingJob.RUNNING,
+                            EmbeddingJob.updated_at < lease_expired)
+                    .update({'status': EmbeddingJob.QUEUED}, synchronize_session=False))
+        db.session.commit()
+        if requeued:
+            print(f"Requeued {requeued} stale embedding jobs")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    job = self._claim()
+                    if job is not None:
+                        self._process(job)
+                        continue
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Embedding worker error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        candidates = (EmbeddingJob.query
+                      .with_entities(EmbeddingJob.id)
+                      .filter(EmbeddingJob.status == EmbeddingJob.QUEUED, EmbeddingJob.run_after <= now)
+                      .order_by(EmbeddingJob.run_after, EmbeddingJob.id)
+                      .limit(self.workers)
+                      .all())
+        for (job_id,) in candidates:
+            claimed = (EmbeddingJob.query
+                       .filter_by(id=job_id, status=EmbeddingJob.QUEUED)
+                       .update({'status': EmbeddingJob.RUNNING,
+                                'attempts': EmbeddingJob.attempts + 1,
+                                'updated_at': now}, synchronize_session=False))
+            db.session.commit()
+            if claimed:
+                return db.session.get(EmbeddingJob, job_id)
+        return None
+
+    def _process(self, job):
+        job_id = job.id
+        doc = job.document
+        chunks = [chunk for chunk in doc.chunks if chunk.embedding_vector is None]
+        try:
+            embedded = IngestionService().embed_chunks(chunks)
+            if embedded < len(chunks):
+                raise RuntimeError(f"{len(chunks) - embedded} of {len(chunks)} chunks could not be embedded")
+            job.status = EmbeddingJob.SUCCEEDED
+            job.last_error = None
+            job.finished_at = datetime.utcnow()
+            if not any(other.status in (EmbeddingJob.QUEUED, EmbeddingJob.RUNNING)
+                       for other in doc.embedding_jobs if other.id != job.id):
+                doc.embedding_status = Document.INDEXED
+            org_id = doc.org_id
+            vectors = [(chunk.id, chunk.get_embedding()) for chunk in chunks]
+            # Fails if an update replaced these chunks meanwhile; the retry
+            # then embeds the replacements
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self._retry_or_fail(job_id, str(e))
+            return
+        vector_index.add_vectors(org_id, [chunk_id for chunk_id, _ in vectors],
+                                 [vector for _, vector in vectors])
+
+    def _retry_or_fail(self, job_id, error):
+        job = db.session.get(EmbeddingJob, job_id)
+        if job is None:
+            return
+        job.last_error = error
+        if job.attempts >= Config.EMBEDDING_JOB_MAX_ATTEMPTS:
+            job.status = EmbeddingJob.FAILED
+            job.finished_at = datetime.utcnow()
+            job.document.embedding_status = Document.FAILED
+            print(f"Embedding job {job.id} failed after {job.attempts} attempts: {error}")
+        else:
+            delay = min(Config.EMBEDDING_JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1),
+                        Config.EMBEDDING_JOB_MAX_BACKOFF_SECONDS)
+            job.status = EmbeddingJob.QUEUED
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.5, 1.0))
+        db.session.commit()
+
+
+embedding_workers = None
+_worker_lock = None
+
+
+def _acquire_worker_lock():
+    """Lock Config.EMBEDDING_WORKER_LOCK for the life of the process; False if another process holds it"""
+    global _worker_lock
+    if fcntl is None:
+        return True
+    os.makedirs(os.path.dirname(os.path.abspath(Config.EMBEDDING_WORKER_LOCK)), exist_ok=True)
+    lock = open(Config.EMBEDDING_WORKER_LOCK, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _worker_lock = lock
+    return True
+
+
+def start_embedding_workers(app):
+    """Start the process-wide worker pool for the given app
+
+    Call it only in the process that serves requests. A second process
+    sharing the lock file gets no pool, since the documents it embedded
+    would never reach the serving process's vector index.
+    """
+    global embedding_workers
+    if embedding_workers is None and Config.EMBEDDING_WORKERS > 0:
+        if not _acquire_worker_lock():
+            print(f"Embedding workers already run in another process ({Config.EMBEDDING_WORKER_LOCK}); "
+                  f"run the app as a single process")
+            return None
+        embedding_workers = EmbeddingWorkerPool(app)
+        embedding_workers.start()
+    return embedding_workers
+
+
+def notify_embedding_workers():
+    if embedding_workers is not None:
+        embedding_workers.notify()
@@ -0,0 +1,87 @@
+import re
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from config import Config
+from app import db
+from app.models.document import Document
+
+TOKEN_PATTERN = re.compile(r'\w+(?:[-./]\w+)*')
+
+# External-content FTS5 table over documents.title/content. Triggers keep it
+# in sync with every write path, including bulk inserts and cascaded deletes.
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+        title, content, content='documents', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+        INSERT INTO documents_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+        INSERT INTO documents_fts(documents_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF title, content ON documents BEGIN
+        INSERT INTO documents_fts(documents_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO documents_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query that ORs each quoted term"""
+    terms = TOKEN_PATTERN.findall(query)
+    return ' OR '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+class LexicalIndex:
+    """BM25 keyword search over document titles and content.
+
+    Backed by SQLite FTS5. On other databases it reports itself unavailable
+    and hybrid retrieval falls back to vector scores only.
+    """
+
+    def available(self):
+        return db.engine.dialect.name == 'sqlite'
+
+    def ensure(self):
+        """Create the FTS table and triggers, indexing existing documents once"""
+        if not self.available():
+            print("Lexical index needs SQLite FTS5; keyword search is disabled")
+            return
+        exists = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'documents_fts'")).first()
+        for statement in SCHEMA:
+            db.session.execute(text(statement))
+        if not exists:
+            db.session.execute(text("INSERT INTO documents_fts(documents_fts) VALUES ('rebuild')"))
+        db.session.commit()
+
+    def search(self, query, org_ids, limit, conditions=None):
+        """Return up to limit (doc_id, score) pairs, best first; higher scores are better
+
+        ``conditions`` are extra SQLAlchemy filters on Document, such as
+        metadata filters, applied in the same query as the MATCH.
+        """
+        expression = match_expression(query)
+        if not expression or not org_ids or not self.available():
+            return []
+        fts = db.table('documents_fts', db.column('rowid'))
+        rank = db.func.bm25(db.literal_column('documents_fts'), Config.LEXICAL_TITLE_WEIGHT, 1.0).label('rank')
+        try:
+            rows = db.session.execute(
+                db.select(Document.id, rank)
+                .select_from(fts.join(Document, Document.id == fts.c.rowid))
+                .where(db.literal_column('documents_fts').op('MATCH')(expression),
+                       Document.org_id.in_(org_ids),
+                       Document.embedding_status != Document.PENDING,
+                       *(conditions or []))
+                .order_by(rank)
+                .limit(limit)).all()
+        except OperationalError as e:
+            # Databases not yet migrated have no documents_fts table
+            print(f"Lexical search unavailable: {e}")
+            return []
+        # bm25() is lower-is-better, so negate it
+        return [(doc_id, -rank) for doc_id, rank in rows]
+
+
+lexical_index = LexicalIndex()
@@ -0,0 +1,100 @@
+import re
+from sqlalchemy import text
+from config import Config
+from app import db
+from app.models.document import Document
+from app.models.document_chunk import DocumentChunk
+
+# Keys are rendered into SQL literally, so that queries use exactly the
+# expression of the index on that key, and must therefore be plain names
+KEY_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+RANGE_OPERATORS = {
+    'gt': lambda field, value: field > value,
+    'gte': lambda field, value: field >= value,
+    'lt': lambda field, value: field < value,
+    'lte': lambda field, value: field <= value,
+}
+
+
+def _postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _value_sql(key):
+    if _postgresql():
+        return f"(document_metadata ->> '{key}')"
+    return f"json_extract(document_metadata, '$.{key}')"
+
+
+def metadata_field(key, value):
+    """SQL expression for a top-level metadata value, comparable with ``value``"""
+    field = db.literal_column(_value_sql(key))
+    if _postgresql() and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return db.cast(field, db.Float)
+    return field
+
+
+def _scalar(key, value):
+    if not isinstance(value, (str, int, float, bool)):
+        raise ValueError(f"Filter value for {key} must be a string, number or boolean")
+    if _postgresql() and isinstance(value, bool):
+        # ->> yields JSON booleans as text
+        return 'true' if value else 'false'
+    return value
+
+
+def filter_conditions(filters):
+    """SQLAlchemy conditions on Document for a metadata filter object
+
+    ``{"key": value}`` matches an equal value, ``{"key": {"in": [...]}}`` any
+    of several and ``{"key": {"gte": ..., "lt": ...}}`` a range. Range bounds
+    are numbers, or ISO 8601 strings for dates, which sort in date order.
+    Raises ValueError for malformed filters.
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be an object of metadata keys")
+    conditions = []
+    for key, spec in filters.items():
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid metadata key: {key}")
+        if not isinstance(spec, dict):
+            spec = {'eq': spec}
+        if not spec:
+            raise ValueError(f"Empty filter for {key}")
+        for operator, value in spec.items():
+            if operator == 'eq':
+                conditions.append(metadata_field(key, value) == _scalar(key, value))
+            elif operator == 'in':
+                if not isinstance(value, list) or not value:
+                    raise ValueError(f"'in' filter for {key} must be a non-empty list")
+                conditions.append(metadata_field(key, value[0]).in_([_scalar(key, item) for item in value]))
+            elif operator in RANGE_OPERATORS:
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    raise ValueError(f"Range bound for {key} must be a number or date string")
+                conditions.append(RANGE_OPERATORS[operator](metadata_field(key, value), value))
+            else:
+                raise ValueError(f"Unsupported filter operator for {key}: {operator}")
+    return conditions
+
+
+def ensure_indexes():
+    """Create an (org_id, value) index on documents for each of Config.INDEXED_METADATA_KEYS"""
+    for key in Config.INDEXED_METADATA_KEYS:
+        if not KEY_PATTERN.match(key):
+            print(f"Skipping index for invalid metadata key: {key}")
+            continue
+        db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_documents_metadata_{key.lower()} "
+                                f"ON documents (org_id, {_value_sql(key)})"))
+    db.session.commit()
+
+
+def matching_chunk_ids(org_ids, conditions):
+    """Ids of the embedded chunks of documents in the organizations that satisfy the conditions"""
+    rows = (db.session.query(DocumentChunk.id)
+            .join(Document, Document.id == DocumentChunk.document_id)
+            .filter(Document.org_id.in_(org_ids),
+                    Document.embedding_status != Document.PENDING,
+                    DocumentChunk.embedding_vector.isnot(None),
+                    *conditions))
+    return {chunk_id for (chunk_id,) in rows}
@@ -0,0 +1,148 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from config import Config
+
+# Latency histogram bucket bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Every counter and histogram name, with its Prometheus type and help text
+DESCRIPTIONS = {
+    'rag_stage_duration_seconds': ('histogram', 'Time spent in each retrieval and generation stage'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce a response, until headers for streams'),
+    'rag_chunks_scanned_total': ('counter', 'Chunk vectors held by the indexes searched'),
+    'rag_documents_loaded_total': ('counter', 'Documents loaded from the database for retrieval'),
+    'openai_requests_total': ('counter', 'Requests sent to the OpenAI API'),
+    'openai_errors_total': ('counter', 'OpenAI API requests that failed'),
+    'openai_retries_total': ('counter', 'OpenAI API requests retried after a 429, 5xx or network error'),
+    'openai_prompt_tokens_total': ('counter', 'Input tokens sent to the OpenAI API'),
+}
+
+
+class Metrics:
+    """In-process counters and latency histograms, rendered as Prometheus text.
+
+    ``span(stage)`` times a block into ``rag_stage_duration_seconds`` and,
+    inside a request, also appends it to that request's breakdown. Spans
+    may nest, e.g. ``embedding_api`` within ``query_embedding``.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def record(self, stage, seconds):
+        """Observe a stage duration and add it to the current request's breakdown"""
+        self.observe('rag_stage_duration_seconds', seconds, stage=stage)
+        if has_request_context():
+            g.setdefault('stage_timings', []).append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def render(self, extra=()):
+        """Prometheus text exposition of every metric plus (name, type, help, [(labels, value)]) extras"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                          for key, value in self._histograms.items()}
+        lines = []
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+        for name in names:
+            kind, description = DESCRIPTIONS[name]
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", repr(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+                lines.append(f'{name}_sum{_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{name}_count{_labels(labels)} {histogram["count"]}')
+        for name, kind, description, samples in extra:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        """Time every request, and add the stage breakdown to JSON responses on request"""
+        @app.before_request
+        def start_timer():
+            g.request_started = time.perf_counter()
+
+        @app.after_request
+        def finish_timer(response):
+            started = g.pop('request_started', None)
+            if started is None:
+                return response
+            elapsed = time.perf_counter() - started
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            self.observe('http_request_duration_seconds', elapsed,
+                         endpoint=endpoint, method=request.method, status=str(response.status_code))
+            if request.headers.get(Config.DEBUG_TIMINGS_HEADER):
+                self._attach_breakdown(app, response, elapsed)
+            return response
+
+    def breakdown(self):
+        """Stage timings of the current request, totalled per stage in first-seen order"""
+        stages = {}
+        for stage, seconds in g.get('stage_timings', []):
+            total = stages.setdefault(stage, {'stage': stage, 'ms': 0.0, 'calls': 0})
+            total['ms'] += seconds * 1000
+            total['calls'] += 1
+        for total in stages.values():
+            total['ms'] = round(total['ms'], 2)
+        return list(stages.values())
+
+    def _attach_breakdown(self, app, response, elapsed):
+        stages = self.breakdown()
+        response.headers['Server-Timing'] = ', '.join(
+            [f"{stage['stage']};dur={stage['ms']}" for stage in stages]
+            + [f'total;dur={round(elapsed * 1000, 2)}'])
+        if response.is_json and not response.is_streamed:
+            data = response.get_json()
+            if isinstance(data, dict):
+                data['timings'] = {'stages': stages, 'total_ms': round(elapsed * 1000, 2)}
+                response.set_data(app.json.dumps(data))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in labels]
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+metrics = Metrics()
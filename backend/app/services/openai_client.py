@@ -0,0 +1,224 @@
+import asyncio
+import random
+import threading
+import time
+import httpx
+import openai
+from config import Config
+from .context_builder import default_counter
+from .metrics import metrics
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError,
+                    openai.APITimeoutError, openai.APIConnectionError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously up to ``per_minute``"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._available = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Take ``amount`` now, going into debt if needed; returns seconds until the debt is repaid"""
+        # A single reservation larger than the bucket would otherwise never fit
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= amount
+            return max(0.0, -self._available / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by every thread.
+
+    Callers reserve capacity up front and sleep off any shortfall, so bursts
+    are spread out instead of being rejected with 429s. A limit of 0 is
+    unlimited.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens):
+        """Reserve one request and ``tokens``; returns the seconds to wait before sending"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens):
+        wait = self.reserve(tokens)
+        if wait:
+            with metrics.span('rate_limit_wait'):
+                time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        """acquire() for coroutines, waiting without blocking the event loop"""
+        wait = self.reserve(tokens)
+        if wait:
+            with metrics.span('rate_limit_wait'):
+                await asyncio.sleep(wait)
+
+
+class OpenAIClientManager:
+    """Process-wide OpenAI client over one keep-alive connection pool.
+
+    Calls are paced by per-API rate limiters and retried with jittered
+    exponential backoff on 429, 5xx, timeouts and connection errors,
+    honouring Retry-After when the API sends it. Other errors are raised
+    immediately. The ``_async`` methods do the same through an AsyncOpenAI
+    client, for the ASGI app; it is bound to the event loop it is first used
+    on, so use them from one loop per process.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+        self.limiters = {
+            'embeddings': RateLimiter(Config.EMBEDDING_REQUESTS_PER_MINUTE, Config.EMBEDDING_TOKENS_PER_MINUTE),
+            'chat': RateLimiter(Config.CHAT_REQUESTS_PER_MINUTE, Config.CHAT_TOKENS_PER_MINUTE)
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                                            max_keepalive_connections=Config.OPENAI_MAX_CONNECTIONS),
+                        timeout=httpx.Timeout(Config.OPENAI_TIMEOUT_SECONDS,
+                                              connect=Config.OPENAI_CONNECT_TIMEOUT_SECONDS)
+                    )
+                    # Retries are handled here so they are paced by the limiter
+                    self._client = openai.OpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL,
+                                                 http_client=http_client, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=Config.OPENAI_MAX_CONNECTIONS,
+                                    max_keepalive_connections=Config.OPENAI_MAX_CONNECTIONS),
+                timeout=httpx.Timeout(Config.OPENAI_TIMEOUT_SECONDS, connect=Config.OPENAI_CONNECT_TIMEOUT_SECONDS)
+            )
+            self._async_client = openai.AsyncOpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL,
+                                                    http_client=http_client, max_retries=0)
+        return self._async_client
+
+    def create_embeddings(self, texts):
+        """Embeddings API call for a list of texts; returns the response"""
+        response = self._call('embeddings', self._embedding_tokens(texts), lambda: self.client.embeddings.create(
+            model=Config.EMBEDDING_MODEL,
+            input=texts
+        ))
+        metrics.increment('openai_prompt_tokens_total', response.usage.prompt_tokens, api='embeddings')
+        return response
+
+    async def create_embeddings_async(self, texts):
+        """create_embeddings() through the async client"""
+        response = await self._call_async('embeddings', self._embedding_tokens(texts),
+                                          lambda: self.async_client.embeddings.create(
+                                              model=Config.EMBEDDING_MODEL,
+                                              input=texts
+                                          ))
+        metrics.increment('openai_prompt_tokens_total', response.usage.prompt_tokens, api='embeddings')
+        return response
+
+    def create_chat_completion(self, messages, **kwargs):
+        """Chat completions API call; with stream=True returns the chunk stream
+
+        The limiter is charged for the prompt plus ``max_tokens``, as the API
+        does when enforcing tokens per minute.
+        """
+        return self._call('chat', self._chat_tokens(messages, kwargs), lambda: self.client.chat.completions.create(
+            model=Config.CHAT_MODEL,
+            messages=messages,
+            **kwargs
+        ))
+
+    async def create_chat_completion_async(self, messages, **kwargs):
+        """create_chat_completion() through the async client; with stream=True returns an async chunk stream"""
+        return await self._call_async('chat', self._chat_tokens(messages, kwargs),
+                                      lambda: self.async_client.chat.completions.create(
+                                          model=Config.CHAT_MODEL,
+                                          messages=messages,
+                                          **kwargs
+                                      ))
+
+    def _embedding_tokens(self, texts):
+        if self.limiters['embeddings'].tokens is None:
+            return 0
+        counter = default_counter()
+        return sum(counter.count(text) for text in texts)
+
+    def _chat_tokens(self, messages, kwargs):
+        counter = default_counter()
+        prompt_tokens = sum(counter.count(message['content']) for message in messages)
+        metrics.increment('openai_prompt_tokens_total', prompt_tokens, api='chat')
+        return prompt_tokens + kwargs.get('max_tokens', 0)
+
+    def _call(self, api, tokens, request):
+        limiter = self.limiters[api]
+        for attempt in range(Config.OPENAI_MAX_RETRIES + 1):
+            limiter.acquire(tokens)
+            metrics.increment('openai_requests_total', api=api)
+            try:
+                return request()
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self._retry_delay(api, attempt, e))
+            except openai.OpenAIError:
+                metrics.increment('openai_errors_total', api=api)
+                raise
+
+    async def _call_async(self, api, tokens, request):
+        """_call() for a ``request`` returning an awaitable"""
+        limiter = self.limiters[api]
+        for attempt in range(Config.OPENAI_MAX_RETRIES + 1):
+            await limiter.acquire_async(tokens)
+            metrics.increment('openai_requests_total', api=api)
+            try:
+                return await request()
+            except RETRYABLE_ERRORS as e:
+                await asyncio.sleep(self._retry_delay(api, attempt, e))
+            except openai.OpenAIError:
+                metrics.increment('openai_errors_total', api=api)
+                raise
+
+    def _retry_delay(self, api, attempt, error):
+        """Seconds to back off after a retryable error; re-raises it once retries are exhausted"""
+        metrics.increment('openai_errors_total', api=api)
+        if attempt == Config.OPENAI_MAX_RETRIES:
+            raise error
+        delay = self._retry_after(error)
+        if delay is None:
+            delay = min(Config.OPENAI_BACKOFF_SECONDS * 2 ** attempt, Config.OPENAI_MAX_BACKOFF_SECONDS)
+            delay *= random.uniform(0.5, 1.0)
+        metrics.increment('openai_retries_total', api=api)
+        return delay
+
+    @staticmethod
+    def _retry_after(error):
+        response = getattr(error, 'response', None)
+        if response is None:
+            return None
+        try:
+            return min(float(response.headers.get('retry-after')), Config.OPENAI_MAX_BACKOFF_SECONDS)
+        except (TypeError, ValueError):
+            return None
+
+
+openai_client = OpenAIClientManager()
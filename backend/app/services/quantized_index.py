@@ -0,0 +1,143 @@
+import numpy as np
+from config import Config
+from .vector_index import VectorIndex
+
+
+def quantize(vectors):
+    """Symmetric int8 codes and per-vector float32 scales for normalized vectors"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class QuantizedVectorIndex(VectorIndex):
+    """Int8 scalar-quantized variant of VectorIndex.
+
+    Each normalized vector is held as int8 codes plus one float32 scale,
+    about a quarter of the float32 footprint. A search scores the codes,
+    keeps the best ``k * rerank_factor`` candidates and re-scores those
+    against full-precision vectors from ``fetch_vectors(ids)``, which
+    returns {id: vector}, so returned scores are exact cosine similarities.
+    """
+
+    # Rows converted to float32 at a time while scoring, bounding scratch memory
+    BLOCK_ROWS = 4096
+
+    def __init__(self, fetch_vectors, dim=None, capacity=256, threads=None,
+                 rerank_factor=Config.QUANTIZATION_RERANK_FACTOR):
+        super().__init__(dim, capacity, threads)
+        self.fetch_vectors = fetch_vectors
+        self.rerank_factor = rerank_factor
+        self._scales = None
+
+    def _ensure_capacity(self, size):
+        if self._matrix is not None and size <= len(self._matrix):
+            return
+        capacity = max(self._capacity, size)
+        if self._matrix is not None:
+            capacity = max(capacity, 2 * len(self._matrix))
+        matrix = np.empty((capacity, self.dim), dtype=np.int8)
+        scales = np.empty(capacity, dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            scales[:self._size] = self._scales[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+        self._matrix = matrix
+        self._scales = scales
+        self._ids = ids
+
+    def add(self, ids, vectors):
+        """Insert or replace the vectors for the given ids"""
+        vectors = self.normalize(vectors)
+        codes, scales = quantize(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+            self._ensure_capacity(self._size + len(vectors))
+            if any(item_id in self._rows for item_id in ids):
+                self._detach()
+            for i, row in enumerate(self._assign_rows(ids)):
+                self._matrix[row] = codes[i]
+                self._scales[row] = scales[i]
+
+    def remove(self, ids):
+        """Drop the given ids, moving the last row into each freed slot"""
+        with self._lock:
+            self._detach()
+            for row, last in self._release_rows(ids):
+                self._matrix[row] = self._matrix[last]
+                self._scales[row] = self._scales[last]
+
+    def _detach(self):
+        if self._readers:
+            super()._detach()
+            self._scales = self._scales.copy()
+
+    def snapshot(self):
+        """Return copies of the live ids and dequantized vectors"""
+        with self._lock:
+            if self._size == 0:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+            vectors = self._matrix[:self._size].astype(np.float32) * self._scales[:self._size, None]
+            return self._ids[:self._size].copy(), vectors
+
+    def memory_bytes(self):
+        """Bytes held by the live rows of codes, scales and ids"""
+        return self._size * ((self.dim or 0) + 4 + 8)
+
+    def _score(self, matrix, scales, queries, start, end, rows=None):
+        """Approximate (rows, queries) scores of a row range, or of ``rows[start:end]``, from the int8 codes"""
+        scores = np.empty((end - start, len(queries)), dtype=np.float32)
+        for block in range(start, end, self.BLOCK_ROWS):
+            block_end = min(block + self.BLOCK_ROWS, end)
+            codes = matrix[block:block_end] if rows is None else matrix[rows[block:block_end]]
+            scores[block - start:block_end - start] = codes.astype(np.float32) @ queries.T
+        scores *= (scales[start:end] if rows is None else scales[rows[start:end]])[:, None]
+        return scores
+
+    def search_batch(self, query_embeddings, k, threshold=None, ids=None):
+        """Return one search result per query, ordered by exact cosine similarity"""
+        queries = self.normalize(query_embeddings)
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return [[] for _ in queries]
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional query, got {queries.shape[1]}")
+            matrix, scales, item_ids, size = self._matrix, self._scales, self._ids, self._size
+            allowed = None if ids is None else self._allowed_rows(ids)
+            self._readers += 1
+        try:
+            if allowed is None:
+                rows, _ = self._top_rows(lambda start, end: self._score(matrix, scales, queries, start, end),
+                                         k * self.rerank_factor, len(queries), size)
+            elif not len(allowed):
+                return [[] for _ in queries]
+            else:
+                positions, _ = self._top_rows(lambda start, end: self._score(matrix, scales, queries, start, end,
+                                                                             allowed),
+                                              k * self.rerank_factor, len(queries), len(allowed))
+                rows = allowed[positions]
+        finally:
+            with self._lock:
+                self._readers -= 1
+        candidates = [[int(item_id) for item_id in item_ids[query_rows]] for query_rows in rows]
+
+        # Re-rank against the stored vectors; ids deleted meanwhile simply drop out
+        vectors = self.fetch_vectors(sorted({item_id for ids in candidates for item_id in ids}))
+        results = []
+        for query, candidate_ids in zip(queries, candidates):
+            found = [item_id for item_id in candidate_ids if vectors.get(item_id) is not None]
+            if not found:
+                results.append([])
+                continue
+            exact = self.normalize([vectors[item_id] for item_id in found]) @ query
+            order = np.argsort(exact)[::-1][:k]
+            hits = [(found[i], float(exact[i])) for i in order]
+            if threshold is not None:
+                hits = [(item_id, score) for item_id, score in hits if score >= threshold]
+            results.append(hits)
+        return results
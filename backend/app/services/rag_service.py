@@ -1,72 +1,285 @@
-import openai
-import numpy as np
+import asyncio
+import time
 from config import Config
 from app.models.document import Document
+from app.models.document_chunk import DocumentChunk
+from app.models.organization import Organization
 from app import db
+from .context_builder import ContextBuilder
+from .lexical_index import lexical_index, TOKEN_PATTERN
+from .metadata_filter import filter_conditions, matching_chunk_ids
+from .metrics import metrics
+from .openai_client import openai_client
+from .vector_index import vector_index
+
+ERROR_RESPONSE = "Sorry, I encountered an error while processing your request."
 
 class RAGService:
     def __init__(self):
-        openai.api_key = Config.OPENAI_API_KEY
+        self.context = None
     
-    def find_relevant_documents(self, query, org_id, limit=Config.MAX_CONTEXT_DOCUMENTS):
-        """Find relevant documents using vector similarity"""
+    def find_relevant_documents(self, query, org_id, limit=Config.MAX_CONTEXT_DOCUMENTS, mode=None, filters=None):
+        """Find relevant documents for a query within one organization
+        
+        Each returned document carries ``relevant_chunks`` (its best matching
+        passages, best first) and ``score`` (its ranking score in ``mode``).
+        ``filters`` restricts the search to documents whose metadata matches
+        (see metadata_filter.filter_conditions) before anything is scored.
+        """
         try:
-            # Generate query embedding
-            from .embedding_service import EmbeddingService
-            embedding_service = EmbeddingService()
-            query_embedding = embedding_service.generate_embedding(query)
-            
-            if not query_embedding:
-                return []
+            return self._retrieve(query, [org_id], limit, mode or Config.RETRIEVAL_MODE, filters)
             
-            # Get all documents for the organization
-            documents = Document.query.filter_by(org_id=org_id).all()
-            
-            # Calculate similarities
-            similarities = []
-            for doc in documents:
-                doc_embedding = doc.get_embedding()
-                if doc_embedding:
-                    similarity = self._cosine_similarity(query_embedding, doc_embedding)
-                    if similarity >= Config.SIMILARITY_THRESHOLD:
-                        similarities.append((doc, similarity))
-            
-            # Sort by similarity and return top documents
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            return [doc for doc, _ in similarities[:limit]]
+        except Exception as e:
+            print(f"Error finding relevant documents: {e}")
+            return []
+    
+    def find_relevant_documents_global(self, query, org_ids=None, limit=Config.MAX_CONTEXT_DOCUMENTS, mode=None,
+                                       filters=None):
+        """Find the most relevant documents across organizations
+        
+        The query is embedded once and every organization's index is scored
+        with it; hits are then ranked globally. ``org_ids`` restricts the
+        search to an allow-list.
+        """
+        try:
+            if org_ids is None:
+                org_ids = [org_id for org_id, in Organization.query.with_entities(Organization.id)]
+            return self._retrieve(query, org_ids, limit, mode or Config.RETRIEVAL_MODE, filters)
             
         except Exception as e:
             print(f"Error finding relevant documents: {e}")
             return []
     
-    def _cosine_similarity(self, vec1, vec2):
-        """Calculate cosine similarity between two vectors"""
+    def find_relevant_documents_batch(self, queries, org_id, limit=Config.MAX_CONTEXT_DOCUMENTS, mode=None,
+                                      filters=None):
+        """Find relevant documents for many queries within one organization
+        
+        The queries are embedded in one generate_embeddings_batch call and
+        scored together as one matrix product, and the matched chunks and
+        documents are loaded once for the whole batch. Returns one ranked
+        list of (document, score, passages) per query; documents are shared
+        between lists, so scores are not set on them. ``filters`` applies to
+        every query.
+        """
         try:
-            vec1 = np.array(vec1)
-            vec2 = np.array(vec2)
+            if not queries:
+                return []
+            mode = mode or Config.RETRIEVAL_MODE
+            conditions, allowed = self._filter_scope([org_id], filters, mode)
+            k = limit * Config.CHUNKS_PER_DOCUMENT
+            vector_hits = [[] for _ in queries]
+            if mode != 'lexical':
+                from .embedding_service import EmbeddingService
+                with metrics.span('query_embedding'):
+                    embeddings = EmbeddingService().generate_embeddings_batch(queries)
+                if embeddings is None and mode == 'vector':
+                    return [[] for _ in queries]
+                if embeddings is None:
+                    mode = 'lexical'
+                else:
+                    with metrics.span('vector_search'):
+                        vector_hits = vector_index.search_batch(org_id, embeddings, k, Config.SIMILARITY_THRESHOLD,
+                                                                allowed)
             
-            dot_product = np.dot(vec1, vec2)
-            norm1 = np.linalg.norm(vec1)
-            norm2 = np.linalg.norm(vec2)
+            with metrics.span('document_load'):
+                chunk_ids = {chunk_id for hits in vector_hits for chunk_id, _ in hits}
+                chunks = {chunk.id: chunk for chunk in DocumentChunk.query.filter(DocumentChunk.id.in_(chunk_ids))}
+            rankings = []
+            for query, hits in zip(queries, vector_hits):
+                if mode == 'lexical':
+                    with metrics.span('lexical_search'):
+                        ranked = [(doc_id, score, None)
+                                  for doc_id, score in lexical_index.search(query, [org_id], limit, conditions)]
+                else:
+                    ranked = self._group_chunks(hits, chunks)
+                    if mode == 'hybrid':
+                        with metrics.span('lexical_search'):
+                            lexical_hits = lexical_index.search(query, [org_id], k, conditions)
+                        ranked = self._fuse(ranked, lexical_hits)
+                rankings.append(ranked[:limit])
             
-            if norm1 == 0 or norm2 == 0:
-                return 0
+            with metrics.span('document_load'):
+                documents = {doc.id: doc for doc in
+                             self._load_documents(list({doc_id for ranked in rankings for doc_id, _, _ in ranked}))}
+                # Chunks of documents found only by keyword, for their passages
+                keyword_chunks = {}
+                keyword_docs = {doc_id for ranked in rankings for doc_id, _, doc_chunks in ranked if not doc_chunks}
+                if keyword_docs:
+                    for chunk in (DocumentChunk.query
+                                  .filter(DocumentChunk.document_id.in_(keyword_docs))
+                                  .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)):
+                        keyword_chunks.setdefault(chunk.document_id, []).append(chunk)
+            results = []
+            tokens = {}
+            for query, ranked in zip(queries, rankings):
+                terms = {term.lower() for term in TOKEN_PATTERN.findall(query)}
+                results.append([(documents[doc_id], score, doc_chunks or self._keyword_chunks(
+                                    documents[doc_id], terms, keyword_chunks.get(doc_id, []), tokens))
+                                for doc_id, score, doc_chunks in ranked if doc_id in documents])
+            return results
             
-            return dot_product / (norm1 * norm2)
         except Exception as e:
-            print(f"Error calculating cosine similarity: {e}")
-            return 0
+            print(f"Error finding relevant documents: {e}")
+            return [[] for _ in queries]
     
-    def generate_response(self, query, relevant_documents):
-        """Generate response using OpenAI with context from relevant documents"""
-        try:
-            # Build context from relevant documents
-            context = ""
-            for i, doc in enumerate(relevant_documents, 1):
-                context += f"Document {i}: {doc.title}\n{doc.content}\n\n"
-            
-            # Create the prompt
-            prompt = f"""Based on the following documents, please answer the user's question. If the answer cannot be found in the documents, please say so.
+    def _retrieve(self, query, org_ids, limit, mode, filters=None):
+        """Rank documents by vector similarity, BM25, or both fused with RRF
+        
+        'lexical' never calls the embeddings API. 'hybrid' degrades to
+        lexical ranking when the query cannot be embedded.
+        """
+        scope = self.prepare_retrieval(query, org_ids, limit, mode, filters)
+        query_embedding = None
+        if mode != 'lexical':
+            with metrics.span('query_embedding'):
+                query_embedding = self.embed_query(query)
+        return self.rank_documents(query, org_ids, limit, mode, scope, query_embedding)
+    
+    def prepare_retrieval(self, query, org_ids, limit, mode, filters=None):
+        """The retrieval work that does not need the query embedding
+        
+        Resolves the metadata filter, runs the keyword search and loads the
+        organizations' vector indexes, so it can run while the query is being
+        embedded. Returns the scope to pass to rank_documents().
+        """
+        conditions, allowed = self._filter_scope(org_ids, filters, mode)
+        lexical_hits = []
+        if mode != 'vector':
+            with metrics.span('lexical_search'):
+                lexical_hits = lexical_index.search(query, org_ids, limit if mode == 'lexical' else
+                                                    limit * Config.CHUNKS_PER_DOCUMENT, conditions)
+        if mode != 'lexical':
+            for org_id in org_ids:
+                vector_index.get(org_id)
+        return allowed, lexical_hits
+    
+    def rank_documents(self, query, org_ids, limit, mode, scope, query_embedding):
+        """Rank and load documents from a prepare_retrieval() scope and the query embedding (None if unavailable)"""
+        allowed, lexical_hits = scope
+        if mode == 'lexical' or query_embedding is None:
+            if mode == 'vector':
+                return []
+            with metrics.span('document_load'):
+                return self._materialize([(doc_id, score, None) for doc_id, score in lexical_hits[:limit]], query)
+        
+        # Score chunks against the organizations' resident indexes
+        with metrics.span('vector_search'):
+            hits = vector_index.search_many(org_ids, query_embedding, limit * Config.CHUNKS_PER_DOCUMENT,
+                                            Config.SIMILARITY_THRESHOLD, allowed)
+        with metrics.span('document_load'):
+            ranked = self._group_chunks(hits)
+        if mode == 'hybrid':
+            ranked = self._fuse(ranked, lexical_hits)
+        with metrics.span('document_load'):
+            return self._materialize(ranked[:limit], query)
+    
+    def _filter_scope(self, org_ids, filters, mode):
+        """(conditions, chunk ids) of a metadata filter, or (None, None) without one
+        
+        The chunk ids of matching documents are looked up only for modes that
+        score vectors; the vector indexes then score just those chunks.
+        """
+        if not filters:
+            return None, None
+        conditions = filter_conditions(filters)
+        if mode == 'lexical':
+            return conditions, None
+        with metrics.span('metadata_filter'):
+            return conditions, matching_chunk_ids(org_ids, conditions)
+    
+    def embed_query(self, query):
+        """Embedding of a query, or None if it cannot be generated"""
+        from .embedding_service import EmbeddingService
+        return EmbeddingService().generate_embedding(query)
+    
+    async def embed_query_async(self, query):
+        """embed_query() for coroutines"""
+        from .embedding_service import EmbeddingService
+        with metrics.span('query_embedding'):
+            return await EmbeddingService().generate_embedding_async(query)
+    
+    def _group_chunks(self, hits, loaded=None):
+        """Group ranked (chunk_id, score) hits into [(doc_id, best score, chunks)], best first
+        
+        ``loaded`` may map chunk ids to chunks already fetched from the database.
+        """
+        if not hits:
+            return []
+        scores = dict(hits)
+        if loaded is None:
+            chunks = DocumentChunk.query.filter(DocumentChunk.id.in_(scores)).all()
+        else:
+            chunks = [loaded[chunk_id] for chunk_id in scores if chunk_id in loaded]
+        chunks.sort(key=lambda chunk: scores[chunk.id], reverse=True)
+        grouped = {}
+        for chunk in chunks:
+            grouped.setdefault(chunk.document_id, []).append(chunk)
+        return [(doc_id, scores[doc_chunks[0].id], doc_chunks[:Config.CHUNKS_PER_DOCUMENT])
+                for doc_id, doc_chunks in grouped.items()]
+    
+    def _fuse(self, vector_ranked, lexical_hits):
+        """Reciprocal rank fusion of vector and lexical document rankings"""
+        scores = {}
+        chunks = {}
+        for rank, (doc_id, _, doc_chunks) in enumerate(vector_ranked, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (Config.RRF_K + rank)
+            chunks[doc_id] = doc_chunks
+        for rank, (doc_id, _) in enumerate(lexical_hits, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (Config.RRF_K + rank)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [(doc_id, scores[doc_id], chunks.get(doc_id)) for doc_id in ranked]
+    
+    def _materialize(self, ranked, query):
+        """Load ranked documents and attach their scores and passages
+        
+        Documents found only by keyword get the chunks sharing most terms
+        with the query as their passages.
+        """
+        documents = self._load_documents([doc_id for doc_id, _, _ in ranked])
+        by_id = {doc_id: (score, chunks) for doc_id, score, chunks in ranked}
+        terms = {term.lower() for term in TOKEN_PATTERN.findall(query)}
+        for doc in documents:
+            doc.score, doc.relevant_chunks = by_id[doc.id]
+            if not doc.relevant_chunks:
+                doc.relevant_chunks = self._keyword_chunks(doc, terms)
+        return documents
+    
+    def _keyword_chunks(self, doc, terms, chunks=None, tokens=None):
+        """A document's chunks ranked by how many query terms they contain
+        
+        ``chunks`` may hold the document's chunks already loaded, and
+        ``tokens`` a dict caching each chunk's terms across queries.
+        """
+        if tokens is None:
+            tokens = {}
+        def matches(chunk):
+            if chunk.id not in tokens:
+                tokens[chunk.id] = {token.lower() for token in TOKEN_PATTERN.findall(chunk.content)}
+            return len(terms & tokens[chunk.id])
+        ranked = sorted(doc.chunks if chunks is None else chunks, key=matches, reverse=True)
+        return ranked[:Config.CHUNKS_PER_DOCUMENT]
+    
+    def _load_documents(self, doc_ids):
+        """Fetch documents by id, preserving the given ranking order"""
+        if not doc_ids:
+            return []
+        documents = Document.query.filter(Document.id.in_(doc_ids)).all()
+        metrics.increment('rag_documents_loaded_total', len(documents))
+        by_id = {doc.id: doc for doc in documents}
+        return [by_id[doc_id] for doc_id in doc_ids if doc_id in by_id]
+    
+    def _build_messages(self, query, relevant_documents):
+        """Build the chat messages for a query and its relevant documents
+        
+        The document context is fitted into Config.CONTEXT_TOKEN_BUDGET; the
+        build report is kept on ``self.context``.
+        """
+        with metrics.span('context_build'):
+            self.context = ContextBuilder().build(relevant_documents)
+        context = self.context['context']
+        
+        # Create the prompt
+        prompt = f"""Based on the following documents, please answer the user's question. If the answer cannot be found in the documents, please say so.
 
 Documents:
 {context}
@@ -74,19 +287,83 @@ Documents:
 User Question: {query}
 
 Answer:"""
+        
+        return [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on provided documents."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def generate_response(self, query, relevant_documents):
+        """Generate response using OpenAI with context from relevant documents"""
+        try:
+            messages = self._build_messages(query, relevant_documents)
+            with metrics.span('llm_completion'):
+                response = openai_client.create_chat_completion(
+                    messages,
+                    max_tokens=500,
+                    temperature=0.7
+                )
             
-            response = openai.chat.completions.create(
-                model=Config.CHAT_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that answers questions based on provided documents."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
+            return response.choices[0].message.content
+            
+        except Exception as e:
+            print(f"Error generating response: {e}")
+            return ERROR_RESPONSE
+    
+    async def generate_response_async(self, query, relevant_documents):
+        """generate_response() for coroutines, awaiting the completion without blocking the event loop"""
+        try:
+            messages = await asyncio.to_thread(self._build_messages, query, relevant_documents)
+            with metrics.span('llm_completion'):
+                response = await openai_client.create_chat_completion_async(
+                    messages,
+                    max_tokens=500,
+                    temperature=0.7
+                )
             
             return response.choices[0].message.content
             
         except Exception as e:
             print(f"Error generating response: {e}")
-            return "Sorry, I encountered an error while processing your request."
+            return ERROR_RESPONSE
+    
+    def stream_response(self, query, relevant_documents):
+        """Yield the completion text incrementally as it arrives from OpenAI
+        
+        Errors are raised to the caller, which is already streaming.
+        """
+        messages = self._build_messages(query, relevant_documents)
+        started = time.perf_counter()
+        first_token = True
+        stream = openai_client.create_chat_completion(
+            messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    metrics.record('llm_first_token', time.perf_counter() - started)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+        metrics.record('llm_completion', time.perf_counter() - started)
+    
+    async def stream_response_async(self, query, relevant_documents):
+        """stream_response() as an async generator"""
+        messages = await asyncio.to_thread(self._build_messages, query, relevant_documents)
+        started = time.perf_counter()
+        first_token = True
+        stream = await openai_client.create_chat_completion_async(
+            messages,
+            max_tokens=500,
+            temperature=0.7,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token:
+                    metrics.record('llm_first_token', time.perf_counter() - started)
+                    first_token = False
+                yield chunk.choices[0].delta.content
+        metrics.record('llm_completion', time.perf_counter() - started)
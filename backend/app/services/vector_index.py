@@ -0,0 +1,454 @@
+import heapq
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import Config
+from app import db
+from app.models.document_chunk import DocumentChunk
+from app.models.document import decode_embedding
+from app.models.organization import Organization
+from .metrics import metrics
+
+_search_pools = {}
+_search_pools_lock = threading.Lock()
+
+
+def search_pool(threads):
+    """Process-wide thread pool with the given number of workers for sharded searches"""
+    pool = _search_pools.get(threads)
+    if pool is None:
+        with _search_pools_lock:
+            pool = _search_pools.get(threads)
+            if pool is None:
+                pool = _search_pools[threads] = ThreadPoolExecutor(threads, thread_name_prefix='vector-search')
+    return pool
+
+
+def indexable_chunks():
+    """Condition on DocumentChunk for embeddings that belong in the index
+
+    Embeddings from another model live in a different vector space, so they
+    are left out until backfill_embeddings.py re-embeds them; ones stored
+    before models were recorded are assumed to be from the configured model.
+    """
+    return db.and_(DocumentChunk.embedding_vector.isnot(None),
+                   db.or_(DocumentChunk.embedding_model.is_(None),
+                          DocumentChunk.embedding_model == Config.EMBEDDING_MODEL))
+
+
+class VectorIndex:
+    """Resident similarity index for the chunk embeddings of one organization.
+
+    Vectors are L2-normalized on insert and kept in a contiguous float32 matrix
+    next to an array of integer ids, so a search is a single matrix-vector
+    product followed by an argpartition top-k. Large indexes are scored in
+    contiguous row shards on a shared thread pool (NumPy releases the GIL
+    during the products, and the shards are views of the same matrix), and
+    the per-shard top-k lists are merged. ``threads`` of None follows
+    Config.SEARCH_THREADS.
+
+    Searches hold the lock only to take the current arrays and row count,
+    then score outside it, so concurrent searches run in parallel. Appends
+    write past the rows searches read; a write that changes live rows while
+    a search is in flight first replaces the arrays with copies.
+    """
+
+    def __init__(self, dim=None, capacity=256, threads=None):
+        self.dim = dim
+        self.threads = threads
+        self._capacity = capacity
+        self._matrix = None
+        self._ids = None
+        self._rows = {}
+        self._size = 0
+        self._readers = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    @staticmethod
+    def normalize(vectors):
+        """Return a float32 copy of the vectors scaled to unit length"""
+        vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _ensure_capacity(self, size):
+        if self._matrix is not None and size <= len(self._matrix):
+            return
+        capacity = max(self._capacity, size)
+        if self._matrix is not None:
+            capacity = max(capacity, 2 * len(self._matrix))
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+        self._matrix = matrix
+        self._ids = ids
+
+    def add(self, ids, vectors):
+        """Insert or replace the vectors for the given ids"""
+        vectors = self.normalize(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+            self._ensure_capacity(self._size + len(vectors))
+            if any(item_id in self._rows for item_id in ids):
+                self._detach()
+            for row, vector in zip(self._assign_rows(ids), vectors):
+                self._matrix[row] = vector
+
+    def remove(self, ids):
+        """Drop the given ids, moving the last row into each freed slot"""
+        with self._lock:
+            self._detach()
+            for row, last in self._release_rows(ids):
+                self._matrix[row] = self._matrix[last]
+
+    def _detach(self):
+        """Copy the arrays before live rows change in place, if searches are scoring the current ones"""
+        if self._readers:
+            self._matrix = self._matrix.copy()
+            self._ids = self._ids.copy()
+
+    def _assign_rows(self, ids):
+        """Row of each id, appending rows for ids not yet stored"""
+        rows = []
+        for item_id in ids:
+            row = self._rows.get(item_id)
+            if row is None:
+                row = self._size
+                self._rows[item_id] = row
+                self._ids[row] = item_id
+                self._size += 1
+            rows.append(row)
+        return rows
+
+    def _release_rows(self, ids):
+        """Forget ids; returns the (row, last) moves to apply to row data, in order"""
+        moves = []
+        for item_id in ids:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                continue
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+                moves.append((row, last))
+            self._size = last
+        return moves
+
+    def snapshot(self):
+        """Return copies of the live ids and normalized vectors"""
+        with self._lock:
+            if self._size == 0:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+            return self._ids[:self._size].copy(), self._matrix[:self._size].copy()
+
+    def memory_bytes(self):
+        """Bytes held by the live rows of vectors and ids"""
+        return self._size * ((self.dim or 0) * 4 + 8)
+
+    def search(self, query_embedding, k, threshold=None, ids=None):
+        """Return up to k (id, score) pairs ordered by cosine similarity
+
+        ``ids`` restricts the search to those ids; only their rows are scored.
+        """
+        return self.search_batch(query_embedding, k, threshold, ids)[0]
+
+    def search_batch(self, query_embeddings, k, threshold=None, ids=None):
+        """Return one search result per query, scoring all queries in one matrix product per block"""
+        queries = self.normalize(query_embeddings)
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return [[] for _ in queries]
+            if queries.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional query, got {queries.shape[1]}")
+            matrix, item_ids, size = self._matrix, self._ids, self._size
+            allowed = None if ids is None else self._allowed_rows(ids)
+            self._readers += 1
+        try:
+            if allowed is None:
+                rows, scores = self._top_rows(lambda start, end: matrix[start:end] @ queries.T,
+                                              k, len(queries), size)
+            elif not len(allowed):
+                return [[] for _ in queries]
+            else:
+                positions, scores = self._top_rows(lambda start, end: matrix[allowed[start:end]] @ queries.T,
+                                                   k, len(queries), len(allowed))
+                rows = allowed[positions]
+        finally:
+            with self._lock:
+                self._readers -= 1
+        results = [[(int(item_id), float(score)) for item_id, score in zip(item_ids[query_rows], query_scores)]
+                   for query_rows, query_scores in zip(rows, scores)]
+        if threshold is not None:
+            results = [[(item_id, score) for item_id, score in hits if score >= threshold] for hits in results]
+        return results
+
+    def _allowed_rows(self, ids):
+        """Rows of the stored ids among ``ids``, in matrix order"""
+        return np.array(sorted(self._rows[item_id] for item_id in ids if item_id in self._rows), dtype=np.int64)
+
+    def search_threads(self):
+        threads = self.threads if self.threads is not None else Config.SEARCH_THREADS
+        return threads or os.cpu_count() or 1
+
+    def shards(self, size=None):
+        """(start, end) row ranges a search of ``size`` rows (default all) scores in parallel"""
+        size = self._size if size is None else size
+        count = min(self.search_threads(), size // Config.SEARCH_SHARD_MIN_ROWS)
+        if count <= 1:
+            return [(0, size)]
+        bounds = np.linspace(0, size, count + 1).astype(np.int64).tolist()
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _top_rows(self, score, k, queries=1, size=None):
+        """Rows of the k best scores for each query and those scores, best first
+
+        ``score(start, end)`` returns the float32 scores of a row range as a
+        (rows, queries) array; ``size`` is the number of rows scored, or
+        positions in a subset of them, and defaults to the whole index. It
+        runs over blocks of at most Config.SEARCH_BLOCK_SCORES scores within
+        each shard, keeping a running top-k, with the shards on the search
+        pool when there are several. Returns two (queries, k) arrays.
+        """
+        block_rows = max(k, Config.SEARCH_BLOCK_SCORES // queries)
+
+        def shard_top(shard):
+            best = None
+            for start in range(shard[0], shard[1], block_rows):
+                end = min(start + block_rows, shard[1])
+                scores = score(start, end)
+                rows = np.broadcast_to(np.arange(start, end)[:, None], scores.shape)
+                if best is not None:
+                    rows = np.concatenate([best[0], rows])
+                    scores = np.concatenate([best[1], scores])
+                best = _select(rows, scores, k)
+            return best
+
+        shards = self.shards(size)
+        if len(shards) == 1:
+            rows, scores = shard_top(shards[0])
+        else:
+            parts = list(search_pool(self.search_threads()).map(shard_top, shards))
+            rows, scores = _select(np.concatenate([shard_rows for shard_rows, _ in parts]),
+                                   np.concatenate([shard_scores for _, shard_scores in parts]), k)
+        order = np.argsort(-scores, axis=0, kind='stable')
+        return np.take_along_axis(rows, order, axis=0).T, np.take_along_axis(scores, order, axis=0).T
+
+
+def _select(rows, scores, k):
+    """The k highest scores in each column of a (rows, queries) array, with their rows"""
+    if k >= len(scores):
+        return rows, scores
+    top = np.argpartition(scores, -k, axis=0)[-k:]
+    return np.take_along_axis(rows, top, axis=0), np.take_along_axis(scores, top, axis=0)
+
+
+class VectorIndexRegistry:
+    """Process-wide map of org_id to vector index.
+
+    An organization's index is built from the database (or mapped from disk
+    for the 'ivf' backend) the first time it is searched and is then kept
+    current by the document routes after each commit, so it never has to be
+    reloaded. Each of those notifications also bumps the organization's
+    corpus version, which caches derived from its documents compare against.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def get(self, org_id):
+        """Return the index for an organization, building it on first use"""
+        org_id = int(org_id)
+        index = self._indexes.get(org_id)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._indexes.get(org_id)
+            if index is None:
+                with metrics.span('index_load'):
+                    index = self._build(org_id)
+                self._indexes[org_id] = index
+            return index
+
+    def _build(self, org_id):
+        if Config.VECTOR_INDEX_BACKEND == 'ivf':
+            return self._open_ivf(org_id)
+        if self.quantization(org_id) == 'int8':
+            from .quantized_index import QuantizedVectorIndex
+            index = QuantizedVectorIndex(self.load_chunk_vectors)
+        else:
+            index = VectorIndex()
+        chunk_ids, vectors = self.load_vectors(org_id)
+        if chunk_ids:
+            index.add(chunk_ids, vectors)
+        return index
+
+    def _index_path(self, org_id):
+        return os.path.join(Config.VECTOR_INDEX_DIR, f'org_{org_id}')
+
+    def _open_ivf(self, org_id):
+        """Map a persisted IVF index, rebuilding it if it disagrees with the database"""
+        from .ann_index import IVFIndex
+        path = self._index_path(org_id)
+        if IVFIndex.exists(path):
+            index = IVFIndex.open(path)
+            count, id_sum = (db.session.query(db.func.count(DocumentChunk.id),
+                                              db.func.coalesce(db.func.sum(DocumentChunk.id), 0))
+                             .filter(DocumentChunk.org_id == org_id, indexable_chunks())
+                             .one())
+            if index.checksum() == (count, id_sum):
+                return index
+            print(f"Rebuilding stale vector index for organization {org_id}")
+            shutil.rmtree(path, ignore_errors=True)
+        chunk_ids, vectors = self.load_vectors(org_id)
+        return IVFIndex.create(path, chunk_ids, vectors)
+
+    def load_vectors(self, org_id):
+        """Read an organization's stored chunk embeddings as (chunk_ids, vectors)"""
+        rows = (DocumentChunk.query
+                .with_entities(DocumentChunk.id, DocumentChunk.embedding_vector)
+                .filter(DocumentChunk.org_id == org_id, indexable_chunks())
+                .all())
+        chunk_ids = [chunk_id for chunk_id, _ in rows]
+        with metrics.span('embedding_decode'):
+            vectors = [decode_embedding(raw) for _, raw in rows]
+        return chunk_ids, vectors
+
+    def load_chunk_vectors(self, chunk_ids):
+        """Read the stored embeddings of the given chunks as {chunk_id: vector}"""
+        if not chunk_ids:
+            return {}
+        rows = (DocumentChunk.query
+                .with_entities(DocumentChunk.id, DocumentChunk.embedding_vector)
+                .filter(DocumentChunk.id.in_(chunk_ids), indexable_chunks())
+                .all())
+        with metrics.span('embedding_decode'):
+            return {chunk_id: decode_embedding(raw) for chunk_id, raw in rows}
+
+    def quantization(self, org_id):
+        """The organization's vector_quantization setting, or the configured default"""
+        org_id = int(org_id)
+        setting = (db.session.query(Organization.vector_quantization)
+                   .filter(Organization.id == org_id)
+                   .scalar())
+        return setting or Config.VECTOR_QUANTIZATION
+
+    def stats(self, org_id):
+        """Size and memory footprint of an organization's index"""
+        org_id = int(org_id)
+        index = self.get(org_id)
+        dim = index.dim or 0
+        stats = {
+            'backend': Config.VECTOR_INDEX_BACKEND,
+            'quantization': 'none' if Config.VECTOR_INDEX_BACKEND == 'ivf' else self.quantization(org_id),
+            'vectors': len(index),
+            'dim': dim
+        }
+        if hasattr(index, 'memory_bytes'):
+            full_precision = len(index) * (dim * 4 + 8)
+            stats['memory_bytes'] = index.memory_bytes()
+            stats['full_precision_bytes'] = full_precision
+            stats['memory_saved_ratio'] = round(1 - stats['memory_bytes'] / full_precision, 3) if full_precision else 0.0
+        return stats
+
+    def search(self, org_id, query_embedding, k, threshold=None, ids=None):
+        """Return the top-k (chunk_id, score) pairs for an organization, among ``ids`` if given"""
+        return self.search_batch(org_id, [query_embedding], k, threshold, ids)[0]
+
+    def search_batch(self, org_id, query_embeddings, k, threshold=None, ids=None):
+        """Return the top-k (chunk_id, score) pairs of an organization for each query"""
+        org_id = int(org_id)
+        index = self.get(org_id)
+        if ids is not None and not isinstance(index, VectorIndex):
+            # IVF lists cannot be narrowed to a subset, so the allowed chunks are scored exactly
+            vectors = self.load_chunk_vectors([item_id for item_id in ids if item_id in index])
+            index = VectorIndex()
+            if vectors:
+                index.add(list(vectors), list(vectors.values()))
+            ids = None
+        scanned = len(index) if ids is None else sum(1 for item_id in ids if item_id in index)
+        metrics.increment('rag_chunks_scanned_total', scanned * len(query_embeddings))
+        if hasattr(index, 'search_batch'):
+            return index.search_batch(query_embeddings, k, threshold, ids)
+        return [index.search(query_embedding, k, threshold) for query_embedding in query_embeddings]
+
+    def search_many(self, org_ids, query_embedding, k, threshold=None, ids=None):
+        """Return the global top-k (chunk_id, score) pairs across organizations, among ``ids`` if given"""
+        hits = []
+        for org_id in org_ids:
+            hits.extend(self.search(org_id, query_embedding, k, threshold, ids))
+        return heapq.nlargest(k, hits, key=lambda hit: hit[1])
+
+    def add_chunks(self, org_id, chunks):
+        """Reflect committed chunk inserts; chunks without embeddings are skipped"""
+        embedded = [chunk for chunk in chunks if chunk.embedding_vector]
+        self.add_vectors(org_id, [chunk.id for chunk in embedded],
+                         [chunk.get_embedding() for chunk in embedded])
+
+    def version(self, org_id):
+        """Counter that changes whenever a document change in the organization is committed"""
+        org_id = int(org_id)
+        return self._versions.get(org_id, 0)
+
+    def add_vectors(self, org_id, chunk_ids, vectors):
+        """Reflect committed chunk inserts given as parallel ids and vectors"""
+        org_id = int(org_id)
+        with self._lock:
+            self._bump(org_id)
+            index = self._indexes.get(org_id)
+            if index is not None and chunk_ids:
+                index.add(chunk_ids, vectors)
+
+    def remove_chunks(self, org_id, chunk_ids):
+        """Reflect committed chunk deletions"""
+        org_id = int(org_id)
+        with self._lock:
+            self._bump(org_id)
+            index = self._indexes.get(org_id)
+            if index is not None and chunk_ids:
+                index.remove(chunk_ids)
+
+    def reset(self, org_id, persisted=False):
+        """Discard an organization's resident index, and with ``persisted`` its files, so it is rebuilt"""
+        org_id = int(org_id)
+        with self._lock:
+            self._bump(org_id)
+            self._discard(org_id)
+            if persisted:
+                shutil.rmtree(self._index_path(org_id), ignore_errors=True)
+
+    def drop_organization(self, org_id):
+        """Reflect a committed organization deletion"""
+        org_id = int(org_id)
+        with self._lock:
+            self._bump(org_id)
+            self._discard(org_id)
+            shutil.rmtree(self._index_path(org_id), ignore_errors=True)
+
+    def _discard(self, org_id):
+        index = self._indexes.pop(org_id, None)
+        if hasattr(index, 'close'):
+            index.close()
+
+    def _bump(self, org_id):
+        self._versions[org_id] = self._versions.get(org_id, 0) + 1
+
+
+vector_index = VectorIndexRegistry()
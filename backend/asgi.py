@@ -0,0 +1,13 @@
+"""
+ASGI entry point: uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Chat queries are served as coroutines with async OpenAI calls, so one
+process holds hundreds of them in flight; see app/asgi.py. Run a single
+process (no --workers): vector indexes and embedding workers are per process.
+"""
+
+from app.asgi import create_asgi_app
+from app.services.job_queue import start_embedding_workers
+
+app = create_asgi_app()
+start_embedding_workers(app.flask_app)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Embed chunks whose embedding is missing or from another model
+
+Finds document chunks with no embedding (sample data from init_db.py,
+documents whose embedding calls failed) or one recorded for a model other
+than Config.EMBEDDING_MODEL, including chunks from before models were
+recorded, and embeds them in parallel batches through
+generate_embeddings_batch. Changing EMBEDDING_MODEL and running this again
+re-embeds everything.
+
+Chunks are scanned in id order a page at a time. After each page is
+committed its last id is written to the checkpoint file, so an interrupted
+run resumes where it stopped; the checkpoint is removed once a run
+completes. Documents still being embedded by background jobs are skipped.
+
+Running app servers keep their resident vector indexes, so restart them
+afterwards. With VECTOR_INDEX_BACKEND=ivf the persisted indexes are
+deleted as well, which breaks servers that still have them open, so stop
+the servers first and pass --force.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from app import create_app, db
+from app.models.document import Document, encode_embedding
+from app.models.document_chunk import DocumentChunk
+from app.services.embedding_service import EmbeddingService
+from app.services.ingestion_service import IngestionService
+from app.services.vector_index import vector_index
+from migrate_db import ensure_schema
+
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'backfill_checkpoint.json')
+
+def load_checkpoint(path, org_id):
+    """Last chunk id committed by an interrupted run with the same model and scope, or 0"""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get('model') != Config.EMBEDDING_MODEL or checkpoint.get('org_id') != org_id:
+        print("Ignoring checkpoint from a run with another model or organization")
+        return 0
+    return checkpoint['last_chunk_id']
+
+def save_checkpoint(path, org_id, last_chunk_id):
+    # Written to a temporary file and renamed, so an interruption never leaves it half-written
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'model': Config.EMBEDDING_MODEL, 'org_id': org_id, 'last_chunk_id': last_chunk_id}, f)
+    os.replace(path + '.tmp', path)
+
+def stale_chunks(after_id, org_id, limit):
+    """Next page of (id, document_id, org_id, content) rows needing an embedding"""
+    query = (DocumentChunk.query
+             .with_entities(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.org_id, DocumentChunk.content)
+             .join(Document, Document.id == DocumentChunk.document_id)
+             .filter(DocumentChunk.id > after_id,
+                     Document.embedding_status != Document.PENDING,
+                     db.or_(DocumentChunk.embedding_vector.is_(None),
+                            DocumentChunk.embedding_model.is_(None),
+                            DocumentChunk.embedding_model != Config.EMBEDDING_MODEL)))
+    if org_id is not None:
+        query = query.filter(DocumentChunk.org_id == org_id)
+    return query.order_by(DocumentChunk.id).limit(limit).all()
+
+def update_statuses(document_ids):
+    """Mark documents indexed when every chunk has an embedding, failed otherwise"""
+    missing = {doc_id for (doc_id,) in (db.session.query(DocumentChunk.document_id)
+                                         .filter(DocumentChunk.document_id.in_(document_ids),
+                                                 DocumentChunk.embedding_vector.is_(None))
+                                         .distinct())}
+    complete = [doc_id for doc_id in document_ids if doc_id not in missing]
+    (Document.query
+     .filter(Document.id.in_(document_ids), Document.embedding_status != Document.PENDING)
+     .update({'embedding_status': db.case((Document.id.in_(complete), Document.INDEXED), else_=Document.FAILED)},
+             synchronize_session=False))
+
+def backfill(workers=4, org_id=None, checkpoint=DEFAULT_CHECKPOINT, restart=False):
+    app = create_app()
+    embedding_service = EmbeddingService()
+    ingestion = IngestionService()
+
+    with app.app_context():
+        ensure_schema()
+        last_id = 0 if restart else load_checkpoint(checkpoint, org_id)
+        if last_id:
+            print(f"Resuming after chunk {last_id}")
+        print(f"Embedding with {Config.EMBEDDING_MODEL}, {workers} parallel requests")
+
+        def embed(batch):
+            return batch, embedding_service.generate_embeddings_batch([row.content for row in batch])
+
+        embedded = 0
+        failed = 0
+        orgs = set()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                rows = stale_chunks(last_id, org_id, workers * Config.EMBEDDING_BATCH_SIZE)
+                if not rows:
+                    break
+                updates = []
+                for batch, embeddings in pool.map(embed, ingestion.batches(rows)):
+                    if not embeddings:
+                        failed += len(batch)
+                        continue
+                    updates.extend({'id': row.id, 'embedding_vector': encode_embedding(embedding),
+                                    'embedding_model': Config.EMBEDDING_MODEL}
+                                   for row, embedding in zip(batch, embeddings))
+                if updates:
+                    db.session.execute(db.update(DocumentChunk), updates)
+                update_statuses(sorted({row.document_id for row in rows}))
+                # Persisted indexes would otherwise keep serving the old vectors.
+                # Dropped before the commit, so an interruption in between
+                # cannot leave re-embedded rows that a resumed run never revisits
+                for touched in {row.org_id for row in rows} - orgs:
+                    vector_index.reset(touched, persisted=True)
+                    orgs.add(touched)
+                db.session.commit()
+                last_id = rows[-1].id
+                save_checkpoint(checkpoint, org_id, last_id)
+                embedded += len(updates)
+                elapsed = time.perf_counter() - started
+                print(f"  embedded {embedded} chunks, {failed} failed (last id {last_id}), "
+                      f"{embedded / elapsed:.1f} chunks/s")
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        elapsed = time.perf_counter() - started
+        rate = embedded / elapsed if elapsed else 0.0
+        print(f"✓ Embedded {embedded} chunks in {elapsed:.1f}s ({rate:.1f} chunks/s), {failed} failed")
+        if failed:
+            print("  Chunks that failed are retried by the next run")
+        return embedded
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='embedding requests in flight')
+    parser.add_argument('--org-id', type=int, help='only this organization')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help='progress file for resuming')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and scan from the start')
+    parser.add_argument('--force', action='store_true',
+                        help='delete persisted ivf indexes; only once the app servers are stopped')
+    args = parser.parse_args()
+    if Config.VECTOR_INDEX_BACKEND == 'ivf' and not args.force:
+        parser.error("VECTOR_INDEX_BACKEND=ivf: the backfill deletes the persisted indexes that running "
+                     "servers have open; stop them and pass --force")
+    backfill(args.workers, args.org_id, args.checkpoint, args.restart)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for document upload, search and chat
+
+Starts the Flask app from create_app() on a local port with a throwaway
+database, pointed at the fake_openai.py stand-in for the OpenAI API.
+Seeds N organizations x M documents through /api/documents/upload, then
+issues search and chat queries built from words of the stored documents.
+Reports p50/p95/p99 latency and throughput per endpoint and writes them
+as JSON so runs can be compared across versions.
+
+With --server asgi the app is served by uvicorn from create_asgi_app()
+instead, so the sync and async chat paths can be compared at the same
+concurrency; --workers caps the sync server's request threads the way a
+gunicorn worker pool would.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from werkzeug.serving import WSGIRequestHandler, make_server
+from fake_openai import FakeOpenAIServer
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def make_vocabulary(rng, size):
+    """Pronounceable pseudo-words, so documents share terms at Zipf-like rates"""
+    syllables = ['ka', 'lo', 'mi', 'ner', 'ta', 'vo', 'sil', 'pra', 'du', 'gen', 'xe', 'ru', 'bel', 'on']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def make_documents(args, rng):
+    vocabulary = make_vocabulary(rng, args.vocabulary)
+    weights = [1.0 / rank for rank in range(1, len(vocabulary) + 1)]
+    documents = {}
+    for org in range(args.orgs):
+        documents[org] = []
+        for i in range(args.docs):
+            words = rng.choices(vocabulary, weights, k=args.doc_words)
+            sentences = [' '.join(words[start:start + 12]).capitalize() + '.'
+                         for start in range(0, len(words), 12)]
+            documents[org].append({
+                'title': f"Benchmark document {org}-{i} {words[0]}",
+                'content': f"Reference {org}-{i}. " + ' '.join(sentences)
+            })
+    return documents
+
+def make_queries(documents, rng, count):
+    """(org index, query) pairs drawn from the words of random stored documents"""
+    queries = []
+    for _ in range(count):
+        org = rng.randrange(len(documents))
+        words = rng.choice(documents[org])['content'].rstrip('.').split()
+        start = rng.randrange(max(1, len(words) - 6))
+        queries.append((org, ' '.join(words[start:start + rng.randint(3, 6)]).lower()))
+    return queries
+
+def post(base_url, path, payload):
+    request = urllib.request.Request(base_url + path, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+def run_phase(name, calls, concurrency):
+    """Run (base_url, path, payload) calls on a thread pool and summarise their latencies"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed(call):
+        base_url, path, payload = call
+        started = time.perf_counter()
+        try:
+            status, _ = post(base_url, path, payload)
+        except Exception as e:
+            status = str(e)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed_ms)
+            if not isinstance(status, int) or status >= 400:
+                errors.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(timed, calls))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = np.array(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'concurrency': concurrency,
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_rps': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+    }
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        result.update({
+            'mean_ms': round(float(latencies.mean()), 2),
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2),
+            'max_ms': round(float(latencies.max()), 2)
+        })
+    if errors:
+        result['error_statuses'] = sorted({str(status) for status in errors})
+    print(f"{name:>8} {result['requests']:>6} {result['errors']:>6} {result.get('p50_ms', 0):>9.1f} "
+          f"{result.get('p95_ms', 0):>9.1f} {result.get('p99_ms', 0):>9.1f} {result['throughput_rps'] or 0:>9.1f}")
+    return result
+
+def limit_concurrency(app, workers):
+    """WSGI middleware letting at most ``workers`` requests run at once, the rest queueing"""
+    slots = threading.BoundedSemaphore(workers)
+
+    def limited(environ, start_response):
+        with slots:
+            return app(environ, start_response)
+    return limited
+
+def serve_asgi(app):
+    """Run an ASGI app under uvicorn on a background thread; returns (base_url, stop)"""
+    import socket
+    import uvicorn
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning', backlog=2048))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, name='benchmark-asgi', daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+    return f'http://127.0.0.1:{sock.getsockname()[1]}', stop
+
+def wait_for_indexing(app, timeout):
+    """Block until background embedding jobs have finished, returning the seconds waited"""
+    from app.models.document import Document
+    started = time.perf_counter()
+    with app.app_context():
+        while time.perf_counter() - started < timeout:
+            pending = Document.query.filter_by(embedding_status=Document.PENDING).count()
+            if not pending:
+                break
+            time.sleep(0.2)
+    return round(time.perf_counter() - started, 3)
+
+def code_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='rag-benchmark-')
+    fake = FakeOpenAIServer(('127.0.0.1', 0), args.dim, args.embedding_latency_ms,
+                            args.chat_latency_ms, args.jitter_ms, args.error_rate)
+    fake.start()
+
+    # Config reads the environment when first imported
+    os.environ.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+        'EMBEDDING_CACHE_PATH': os.path.join(workdir, 'embedding_cache.db'),
+        'VECTOR_INDEX_DIR': os.path.join(workdir, 'indexes'),
+        'EMBEDDING_WORKER_LOCK': os.path.join(workdir, 'embedding_workers.lock'),
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': fake.base_url,
+        'ASYNC_EMBEDDING': 'true' if args.async_embedding else 'false',
+        'ANSWER_CACHE_ENABLED': 'true' if args.answer_cache else 'false'
+    })
+    # Client-side rate limits are off unless set explicitly in the environment
+    for limit in ('EMBEDDING_REQUESTS_PER_MINUTE', 'EMBEDDING_TOKENS_PER_MINUTE',
+                  'CHAT_REQUESTS_PER_MINUTE', 'CHAT_TOKENS_PER_MINUTE'):
+        os.environ.setdefault(limit, '0')
+    from app import create_app
+    from app.services.embedding_cache import embedding_cache
+    from app.services.job_queue import start_embedding_workers
+    from migrate_db import ensure_schema
+
+    app = create_app()
+    with app.app_context():
+        ensure_schema()
+    if args.async_embedding:
+        start_embedding_workers(app)
+    if args.server == 'asgi':
+        from app.asgi import create_asgi_app
+        base_url, stop_server = serve_asgi(create_asgi_app(app))
+    else:
+        server = make_server('127.0.0.1', 0, limit_concurrency(app, args.workers) if args.workers else app,
+                             threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        stop_server = server.shutdown
+
+    try:
+        documents = make_documents(args, rng)
+        org_ids = []
+        for org in range(args.orgs):
+            _, created = post(base_url, '/api/organizations/', {'name': f'Benchmark organization {org}'})
+            org_ids.append(created['organization']['id'])
+
+        print(f"{args.orgs} organizations x {args.docs} documents, concurrency {args.concurrency}, "
+              f"{args.server} server{f' with {args.workers} workers' if args.server == 'wsgi' and args.workers else ''}\n")
+        print(f"{'endpoint':>8} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+        results = {}
+        uploads = [(base_url, '/api/documents/upload', {'org_id': org_ids[org], **doc})
+                   for org, docs in documents.items() for doc in docs]
+        rng.shuffle(uploads)
+        results['upload'] = run_phase('upload', uploads, args.concurrency)
+        if args.async_embedding:
+            results['upload']['indexing_wait_seconds'] = wait_for_indexing(app, args.index_timeout)
+
+        searches = [(base_url, '/api/documents/search', {'org_id': org_ids[org], 'query': query, 'mode': args.mode})
+                    for org, query in make_queries(documents, rng, args.searches)]
+        results['search'] = run_phase('search', searches, args.concurrency)
+        if args.search_batch:
+            # The same queries again, grouped per organization into batch requests
+            by_org = {}
+            for _, _, payload in searches:
+                by_org.setdefault(payload['org_id'], []).append(payload['query'])
+            batches = [(base_url, '/api/documents/search/batch',
+                        {'org_id': org_id, 'queries': queries[start:start + args.search_batch], 'mode': args.mode})
+                       for org_id, queries in by_org.items()
+                       for start in range(0, len(queries), args.search_batch)]
+            results['search_batch'] = run_phase('batch', batches, args.concurrency)
+            results['search_batch']['queries_per_second'] = round(
+                len(searches) / results['search_batch']['wall_seconds'], 2)
+            results['search']['queries_per_second'] = results['search']['throughput_rps']
+            print(f"{'':>8} {len(searches)} queries: {results['search']['queries_per_second']} queries/s one at a time, "
+                  f"{results['search_batch']['queries_per_second']} queries/s batched")
+
+        chats = [(base_url, '/api/chat/query', {'org_id': org_ids[org], 'query': query, 'mode': args.mode})
+                 for org, query in make_queries(documents, rng, args.chats)]
+        results['chat'] = run_phase('chat', chats, args.concurrency)
+
+        report = {
+            'version': code_version(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': sys.version.split()[0],
+            'parameters': vars(args),
+            'results': results,
+            'fake_api_requests': dict(fake.requests),
+            'embedding_cache': embedding_cache.stats()
+        }
+    finally:
+        stop_server()
+        fake.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orgs', type=int, default=3, help='organizations to seed (N)')
+    parser.add_argument('--docs', type=int, default=100, help='documents per organization (M)')
+    parser.add_argument('--doc-words', type=int, default=300, help='words per document')
+    parser.add_argument('--vocabulary', type=int, default=5000, help='distinct words across documents')
+    parser.add_argument('--searches', type=int, default=200)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads per phase')
+    parser.add_argument('--search-batch', type=int, default=0, metavar='N',
+                        help='also send the search queries in batches of N to /api/documents/search/batch')
+    parser.add_argument('--server', default='wsgi', choices=['wsgi', 'asgi'],
+                        help='serve create_app() threaded, or create_asgi_app() under uvicorn')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='request threads of the wsgi server, like gunicorn --threads (default: one per request)')
+    parser.add_argument('--mode', default='hybrid', choices=['hybrid', 'vector', 'lexical'], help='retrieval mode')
+    parser.add_argument('--dim', type=int, default=1536, help='fake embedding dimension')
+    parser.add_argument('--embedding-latency-ms', type=float, default=50.0, help='fake embeddings API latency')
+    parser.add_argument('--chat-latency-ms', type=float, default=300.0, help='fake chat API latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform +/- jitter on fake API latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of fake API requests failing with 429/503')
+    parser.add_argument('--async-embedding', action='store_true', help='embed uploads on the background workers')
+    parser.add_argument('--index-timeout', type=float, default=600.0, help='seconds to wait for background embedding')
+    parser.add_argument('--answer-cache', action='store_true', help='keep the chat answer cache enabled')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the temporary database and indexes')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    benchmark(parser.parse_args())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Recall/latency check for the approximate (IVF) and quantized vector indexes
+
+Builds throwaway IVF indexes over one organization's stored embeddings and
+compares their top-k against exact search, so IVF_NLIST and IVF_NPROBE can
+be chosen before switching VECTOR_INDEX_BACKEND to 'ivf'. With --int8 it
+instead reports the recall and memory of int8 quantization per re-rank
+factor, before turning on an organization's vector_quantization. With
+--threads it also times sharded exact search at each SEARCH_THREADS value.
+"""
+
+import argparse
+import tempfile
+import time
+import numpy as np
+from app import create_app
+from app.services.ann_index import IVFIndex, recall_at_k
+from app.services.quantized_index import QuantizedVectorIndex
+from config import Config
+from app.services.vector_index import VectorIndex, vector_index
+
+def check_recall(org_id, k, num_queries, nlists, nprobes, noise, rerank_factors=None, threads=None):
+    app = create_app()
+
+    with app.app_context():
+        chunk_ids, vectors = vector_index.load_vectors(org_id)
+    if not chunk_ids:
+        print(f"Organization {org_id} has no embedded chunks")
+        return
+
+    exact = VectorIndex()
+    exact.add(chunk_ids, vectors)
+    vectors = VectorIndex.normalize(vectors)
+
+    # Perturbed copies of stored vectors stand in for real queries
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False)]
+    queries = sample + rng.normal(scale=noise, size=sample.shape).astype(np.float32)
+
+    started = time.perf_counter()
+    for query in queries:
+        exact.search(query, k)
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    print(f"{len(chunk_ids)} vectors, {len(queries)} queries, exact search {exact_ms:.2f} ms/query\n")
+    if threads:
+        check_threads(exact, queries, k, threads)
+    if rerank_factors:
+        check_quantized(exact, chunk_ids, vectors, queries, k, rerank_factors)
+        return
+    print(f"{'nlist':>6} {'nprobe':>6} {'recall@' + str(k):>10} {'ms/query':>9}")
+
+    for nlist in nlists:
+        with tempfile.TemporaryDirectory() as path:
+            index = IVFIndex.create(path, chunk_ids, vectors, nlist=nlist)
+            for nprobe in nprobes:
+                started = time.perf_counter()
+                for query in queries:
+                    index.search(query, k, nprobe=nprobe)
+                elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+                recall = recall_at_k(index, exact, queries, k, nprobe=nprobe)
+                print(f"{nlist:>6} {nprobe:>6} {recall:>10.3f} {elapsed_ms:>9.2f}")
+
+def check_threads(exact, queries, k, threads):
+    print(f"{'threads':>7} {'shards':>6} {'ms/query':>9}  (shards hold at least {Config.SEARCH_SHARD_MIN_ROWS} rows)")
+    for count in threads:
+        exact.threads = count
+        started = time.perf_counter()
+        for query in queries:
+            exact.search(query, k)
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        print(f"{count:>7} {len(exact.shards()):>6} {elapsed_ms:>9.2f}")
+    exact.threads = None
+    print()
+
+def check_quantized(exact, chunk_ids, vectors, queries, k, rerank_factors):
+    full_vectors = dict(zip(chunk_ids, vectors))
+    index = QuantizedVectorIndex(lambda ids: {item_id: full_vectors[item_id] for item_id in ids})
+    index.add(chunk_ids, vectors)
+    saved = 1 - index.memory_bytes() / exact.memory_bytes()
+    print(f"int8 index {index.memory_bytes() / 2**20:.2f} MiB vs float32 {exact.memory_bytes() / 2**20:.2f} MiB "
+          f"({saved:.0%} smaller)\n")
+    print(f"{'rerank':>6} {'recall@' + str(k):>10} {'ms/query':>9}")
+    for factor in rerank_factors:
+        index.rerank_factor = factor
+        started = time.perf_counter()
+        for query in queries:
+            index.search(query, k)
+        elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        recall = recall_at_k(index, exact, queries, k)
+        print(f"{factor:>6} {recall:>10.3f} {elapsed_ms:>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('org_id', type=int)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--nlist', type=int, nargs='+', default=[64, 256])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--noise', type=float, default=0.02, help='query perturbation scale')
+    parser.add_argument('--int8', type=int, nargs='*', metavar='RERANK',
+                        help='check int8 quantization instead, at these re-rank factors (default 1 2 4 8)')
+    parser.add_argument('--threads', type=int, nargs='+', help='time exact search with these SEARCH_THREADS values')
+    args = parser.parse_args()
+    rerank_factors = args.int8 or ([1, 2, 4, 8] if args.int8 is not None else None)
+    check_recall(args.org_id, args.k, args.queries, args.nlist, args.nprobe, args.noise, rerank_factors, args.threads)
@@ -3,14 +3,111 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///rag_documents.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # e.g. a local stand-in such as fake_openai.py
+    
+    # Shared OpenAI client: connection pool, timeouts, retries and rate limits
+    OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))  # keep-alive pool per process
+    OPENAI_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_TIMEOUT_SECONDS', 60.0))
+    OPENAI_CONNECT_TIMEOUT_SECONDS = 5.0
+    OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 5))  # on 429, 5xx, timeouts and connection errors
+    OPENAI_BACKOFF_SECONDS = 0.5  # doubled after every retry unless the API sends Retry-After
+    OPENAI_MAX_BACKOFF_SECONDS = 30.0
+    # Per-process limits; 0 is unlimited. Set them to your account's limits divided by the process count.
+    EMBEDDING_REQUESTS_PER_MINUTE = int(os.environ.get('EMBEDDING_REQUESTS_PER_MINUTE', 3000))
+    EMBEDDING_TOKENS_PER_MINUTE = int(os.environ.get('EMBEDDING_TOKENS_PER_MINUTE', 1000000))
+    CHAT_REQUESTS_PER_MINUTE = int(os.environ.get('CHAT_REQUESTS_PER_MINUTE', 3500))
+    CHAT_TOKENS_PER_MINUTE = int(os.environ.get('CHAT_TOKENS_PER_MINUTE', 160000))
     
     # RAG Configuration
-    EMBEDDING_MODEL = 'text-embedding-ada-002'
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'text-embedding-ada-002')  # run backfill_embeddings.py after changing
     CHAT_MODEL = 'gpt-3.5-turbo'
     MAX_CONTEXT_DOCUMENTS = 5
+    SEARCH_MAX_LIMIT = 100  # results a search request may ask for per query
     SIMILARITY_THRESHOLD = 0.7
+    
+    # Retrieval: 'hybrid' fuses vector and BM25 rankings, 'vector' or 'lexical' use one
+    RETRIEVAL_MODE = os.environ.get('RETRIEVAL_MODE', 'hybrid')
+    RETRIEVAL_MODES = ('hybrid', 'vector', 'lexical')
+    RRF_K = 60  # reciprocal rank fusion damping; larger flattens rank differences
+    LEXICAL_TITLE_WEIGHT = 2.0  # BM25 weight of title matches relative to content
+    SEARCH_BATCH_MAX_QUERIES = 500  # queries per batch search request, embedded in one API call
+    # document_metadata keys filtered on often enough to index, comma-separated, e.g. "category,published_at"
+    INDEXED_METADATA_KEYS = tuple(key.strip() for key in os.environ.get('INDEXED_METADATA_KEYS', '').split(',') if key.strip())
+    
+    # Chunked ingestion
+    CHUNK_SIZE = 1000  # characters per chunk
+    CHUNK_OVERLAP = 200  # characters shared by consecutive chunks
+    CHUNKS_PER_DOCUMENT = 3  # passages per retrieved document in the prompt
+    EMBEDDING_BATCH_SIZE = 100  # inputs per embeddings API call
+    EMBEDDING_BATCH_MAX_CHARS = 200000  # characters per embeddings API call
+    
+    # Embedding cache, keyed by (EMBEDDING_MODEL, SHA-256 of the text)
+    EMBEDDING_CACHE_MEMORY_ENTRIES = 10000
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(BASE_DIR, 'instance', 'embedding_cache.db'))  # empty disables the disk tier
+    EMBEDDING_CACHE_DISK_ENTRIES = 500000
+    
+    # Observability: GET /metrics serves Prometheus text; requests sending this
+    # header get their per-stage timings in the JSON body and Server-Timing
+    DEBUG_TIMINGS_HEADER = 'X-Debug-Timings'
+    
+    # Prompt context
+    CONTEXT_TOKEN_BUDGET = 3000  # tokens of document passages per prompt
+    TOKENIZER_FALLBACK_ENCODING = 'cl100k_base'  # for models tiktoken does not know
+    
+    # Answer cache for chat queries, invalidated by any document change in the organization
+    ANSWER_CACHE_ENABLED = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+    ANSWER_CACHE_MAX_ENTRIES = 1000
+    ANSWER_CACHE_TTL_SECONDS = 3600
+    ANSWER_CACHE_SIMILARITY = 0.95  # cosine similarity for a query to reuse a stored answer
+    
+    # Document listing
+    DOCUMENTS_PAGE_SIZE = 100
+    DOCUMENTS_MAX_PAGE_SIZE = 1000  # also the batch size of streamed listings
+    
+    # Bulk upload
+    BULK_MAX_DOCUMENTS = 1000  # documents accepted per request
+    BULK_INSERT_BATCH_SIZE = 200  # documents per insert transaction
+    
+    # Bulk deletion
+    DELETE_BATCH_SIZE = 500  # documents per delete transaction, bounding lock time and memory
+    
+    # Vector index backend: 'exact' (in-memory matrix) or 'ivf' (approximate, persisted)
+    VECTOR_INDEX_BACKEND = os.environ.get('VECTOR_INDEX_BACKEND', 'exact')
+    VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', os.path.join(BASE_DIR, 'instance', 'indexes'))
+    IVF_NLIST = int(os.environ.get('IVF_NLIST', 0))  # 0 picks ~sqrt(vectors) per org
+    IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 8))  # higher is slower with better recall
+    IVF_MIN_TRAIN_SIZE = 1024  # smaller orgs use a single list, i.e. exact search
+    IVF_COMPACT_RATIO = 0.1  # re-cluster once pending changes exceed this share of the base
+    
+    # Embedding quantization for the 'exact' backend: 'none' (float32) or 'int8' (~4x smaller);
+    # organizations can override it, see PUT /api/organizations/<id>
+    VECTOR_QUANTIZATION = os.environ.get('VECTOR_QUANTIZATION', 'none')
+    VECTOR_QUANTIZATION_MODES = ('none', 'int8')
+    QUANTIZATION_RERANK_FACTOR = 4  # int8 candidates per result re-scored at full precision
+    
+    # Sharded exact search: large indexes are split into row shards scored on a thread pool
+    SEARCH_THREADS = int(os.environ.get('SEARCH_THREADS', 1))  # 1 scores on the request thread, 0 uses every core
+    SEARCH_SHARD_MIN_ROWS = 20000  # no shard is smaller than this, so small indexes stay single-threaded
+    SEARCH_BLOCK_SCORES = 1 << 22  # scores held at once per shard, bounding batch search memory
+    
+    # Background embedding jobs for upload and content updates
+    ASYNC_EMBEDDING = os.environ.get('ASYNC_EMBEDDING', 'true').lower() == 'true'
+    EMBEDDING_WORKERS = int(os.environ.get('EMBEDDING_WORKERS', 2))  # concurrent embedding jobs per process
+    EMBEDDING_JOB_POLL_SECONDS = 2.0
+    EMBEDDING_JOB_MAX_ATTEMPTS = 5
+    EMBEDDING_JOB_BACKOFF_SECONDS = 2.0  # doubled after every failed attempt
+    EMBEDDING_JOB_MAX_BACKOFF_SECONDS = 300.0
+    EMBEDDING_JOB_LEASE_SECONDS = 600  # running jobs older than this are requeued at startup
+    # Held by the one process running embedding workers, which must be the one serving searches
+    EMBEDDING_WORKER_LOCK = os.environ.get('EMBEDDING_WORKER_LOCK', os.path.join(BASE_DIR, 'instance', 'embedding_workers.lock'))
+    
+    # ASGI serving (asgi.py): chat queries run as coroutines on one event loop
+    ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 8))  # threads for their database and index work
+    ASYNC_FLASK_THREADS = int(os.environ.get('ASYNC_FLASK_THREADS', 16))  # threads serving every other route
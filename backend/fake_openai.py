@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI embeddings and chat completions API
+
+Embeddings are deterministic hashed bag-of-words vectors, so texts that
+share words are similar and repeated runs give identical results. Every
+response waits a configurable latency first, and a share of requests can
+fail with 429 or 503 to exercise retries. Point the backend at it with
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1/.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+WORD = re.compile(r'\w+')
+
+ANSWER = ("Based on the provided documents, the answer is summarised in the "
+          "first source. The remaining sources add supporting detail.")
+
+
+def embed(text, dim):
+    """Unit vector of the hashed word counts of a text"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = norm = 1.0
+    return vector / norm
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # benchmarks open hundreds of connections at once
+
+    def __init__(self, address, dim=1536, embedding_latency_ms=50.0, chat_latency_ms=300.0,
+                 jitter_ms=0.0, error_rate=0.0):
+        super().__init__(address, FakeOpenAIHandler)
+        self.dim = dim
+        self.embedding_latency_ms = embedding_latency_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = {'embeddings': 0, 'chat': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1/'
+
+    def wait(self, latency_ms):
+        time.sleep(max(0.0, latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000)
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def start(self):
+        """Serve from a daemon thread; returns the thread"""
+        thread = threading.Thread(target=self.serve_forever, name='fake-openai', daemon=True)
+        thread.start()
+        return thread
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if random.random() < self.server.error_rate:
+            self.server.count('failed')
+            if random.random() < 0.5:
+                self.send_response(429)
+                self.send_header('Retry-After', '0.05')
+                payload = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+            else:
+                self.send_response(503)
+                payload = {'error': {'message': 'Service unavailable', 'type': 'server_error'}}
+            raw = json.dumps(payload).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+        elif self.path.endswith('/embeddings'):
+            self.server.count('embeddings')
+            self._embeddings(body)
+        elif self.path.endswith('/chat/completions'):
+            self.server.count('chat')
+            self._chat(body)
+        else:
+            self._json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+    def _embeddings(self, body):
+        inputs = body.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.server.wait(self.server.embedding_latency_ms)
+        data = []
+        for i, text in enumerate(inputs):
+            vector = embed(text, self.server.dim)
+            if body.get('encoding_format') == 'base64':
+                embedding = base64.b64encode(vector.astype('<f4').tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({'object': 'embedding', 'index': i, 'embedding': embedding})
+        tokens = sum(len(WORD.findall(text)) for text in inputs)
+        self._json(200, {
+            'object': 'list',
+            'data': data,
+            'model': body.get('model', 'fake-embedding'),
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+        })
+
+    def _chat(self, body):
+        model = body.get('model', 'fake-chat')
+        prompt_tokens = sum(len(WORD.findall(message.get('content', ''))) for message in body.get('messages', []))
+        if not body.get('stream'):
+            self.server.wait(self.server.chat_latency_ms)
+            self._json(200, {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ANSWER}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(ANSWER.split()),
+                          'total_tokens': prompt_tokens + len(ANSWER.split())}
+            })
+            return
+
+        # The latency is split between time to first token and the rest of the stream
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        words = ANSWER.split(' ')
+        per_token_ms = self.server.chat_latency_ms / 2 / len(words)
+        self.server.wait(self.server.chat_latency_ms / 2)
+        for i, word in enumerate(words):
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': word if i == 0 else ' ' + word}, 'finish_reason': None}]
+            }
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+            self.wfile.flush()
+            time.sleep(per_token_ms / 1000)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _json(self, status, payload):
+        raw = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--dim', type=int, default=1536, help='embedding dimension')
+    parser.add_argument('--embedding-latency-ms', type=float, default=50.0)
+    parser.add_argument('--chat-latency-ms', type=float, default=300.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='uniform +/- jitter added to each latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with 429 or 503')
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), args.dim, args.embedding_latency_ms,
+                              args.chat_latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Fake OpenAI API listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ Database initialization script for RAG Document Management System
 from app import create_app, db
 from app.models.organization import Organization
 from app.models.document import Document
+from app.services.ingestion_service import IngestionService
+from migrate_db import ensure_schema
 
 def init_database():
     """Initialize the database with tables and sample data"""
@@ -13,7 +15,7 @@ def init_database():
     
     with app.app_context():
         # Create all tables
-        db.create_all()
+        ensure_schema()
         print("✓ Database tables created successfully")
         
         # Create sample organizations
@@ -66,11 +68,15 @@ def init_database():
                 ).first()
                 
                 if not existing_doc:
+                    # Chunks are stored without embeddings; backfill_embeddings.py embeds
+                    # them and marks the documents indexed
                     doc = Document(
                         org_id=org.id,
                         title=doc_data["title"],
                         content=doc_data["content"]
                     )
+                    doc.embedding_status = Document.FAILED
+                    doc.chunks = IngestionService().build_chunks(doc)
                     db.session.add(doc)
                     print(f"✓ Created document: {doc_data['title']} for {doc_data['org_name']}")
         
@@ -79,8 +85,9 @@ def init_database():
         print("\n🎉 Database initialization completed successfully!")
         print("\nNext steps:")
         print("1. Set your OpenAI API key in the .env file")
-        print("2. Run: python app.py")
-        print("3. Navigate to http://localhost:3000")
+        print("2. Run: python backfill_embeddings.py")
+        print("3. Run: python app.py")
+        print("4. Navigate to http://localhost:3000")
 
 if __name__ == "__main__":
     init_database()
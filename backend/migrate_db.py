@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Schema migration script for RAG Document Management System
+
+Creates any missing tables and columns, converts legacy JSON embeddings to
+the binary float32 format, and splits documents from before chunked
+ingestion into chunks, all in batches. Safe to run repeatedly.
+"""
+
+import argparse
+import json
+import time
+from sqlalchemy import inspect, text
+from app import create_app, db
+from app.models.document import Document, encode_embedding
+from app.services.ingestion_service import IngestionService
+from app.services.lexical_index import lexical_index
+from app.services.metadata_filter import ensure_indexes as ensure_metadata_indexes
+
+def ensure_schema():
+    """Create missing tables, then add columns and indexes introduced after a table was created"""
+    db.create_all()
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            default = ''
+            if column.server_default is not None:
+                default = f" DEFAULT '{column.server_default.arg}'"
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+            print(f"✓ Added column {table.name}.{column.name}")
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.engine)
+                print(f"✓ Created index {index.name}")
+    db.session.commit()
+    lexical_index.ensure()
+    ensure_metadata_indexes()
+
+def convert_embeddings(batch_size=500):
+    """Rewrite legacy JSON embeddings as binary float32, one batch per transaction"""
+    converted = 0
+    started = time.perf_counter()
+    while True:
+        rows = (Document.query
+                .with_entities(Document.id, Document.embedding)
+                .filter(Document.embedding.isnot(None), Document.embedding_vector.is_(None))
+                .order_by(Document.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        db.session.execute(db.update(Document), [
+            {'id': doc_id, 'embedding_vector': encode_embedding(json.loads(raw)), 'embedding': None}
+            for doc_id, raw in rows
+        ])
+        db.session.commit()
+        converted += len(rows)
+        print(f"  converted {converted} embeddings (last id {rows[-1][0]})")
+    elapsed = time.perf_counter() - started
+    print(f"✓ Converted {converted} embeddings to binary in {elapsed:.1f}s")
+    return converted
+
+def chunk_documents(batch_size=500):
+    """Create chunks for documents stored before chunked ingestion
+
+    A document that fits in one chunk keeps its existing embedding; longer
+    documents have their chunks embedded through the embeddings API.
+    """
+    ingestion = IngestionService()
+    chunked = 0
+    embedded = 0
+    missing = 0
+    while True:
+        docs = (Document.query
+                .filter(~Document.chunks.any())
+                .order_by(Document.id)
+                .limit(batch_size)
+                .all())
+        if not docs:
+            break
+        for doc in docs:
+            chunks = ingestion.build_chunks(doc)
+            embedding = doc.get_embedding()
+            if len(chunks) == 1 and embedding is not None:
+                # Whole-document embeddings predate model tracking, so their model is unknown
+                chunks[0].set_embedding(embedding, model=None)
+                embedded += 1
+            else:
+                embedded += ingestion.embed_chunks(chunks)
+            missing += sum(1 for chunk in chunks if chunk.embedding_vector is None)
+            doc.chunks = chunks
+            IngestionService.update_status(doc)
+        db.session.commit()
+        chunked += len(docs)
+        print(f"  chunked {chunked} documents (last id {docs[-1].id})")
+    print(f"✓ Chunked {chunked} documents, {embedded} chunks embedded, {missing} chunks without embeddings")
+    return chunked
+
+def migrate(batch_size=500, vacuum=False):
+    app = create_app()
+
+    with app.app_context():
+        ensure_schema()
+        convert_embeddings(batch_size)
+        chunk_documents(batch_size)
+        if vacuum and db.engine.dialect.name == 'sqlite':
+            # SQLite only returns freed pages to the filesystem on VACUUM
+            with db.engine.connect() as connection:
+                connection.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+            print("✓ Database vacuumed")
+        print("\n🎉 Migration completed successfully!")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-size', type=int, default=500, help='rows converted per transaction')
+    parser.add_argument('--vacuum', action='store_true', help='compact the SQLite file afterwards')
+    args = parser.parse_args()
+    migrate(args.batch_size, args.vacuum)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Export an organization's corpus to an .npz file, or import one
+
+The export holds every document's text and metadata plus its chunks with
+their float32 embeddings, so importing it into another organization or
+database makes the documents searchable without calling the embeddings
+API. Documents whose content already exists in the organization are
+skipped on import. Content is unique across a database, so an export
+cannot be imported into a second organization of the database it came
+from; the import is refused if any document belongs to another one.
+"""
+
+import argparse
+import os
+import time
+from config import Config
+from app import create_app, db
+from app.models.organization import Organization
+from app.services.corpus_transfer import export_organization, import_organization
+from migrate_db import ensure_schema
+
+def export_corpus(org_id, path):
+    app = create_app()
+
+    with app.app_context():
+        if db.session.get(Organization, org_id) is None:
+            print(f"Organization {org_id} not found")
+            return
+        started = time.perf_counter()
+        with open(path, 'wb') as f:
+            counts = export_organization(org_id, f)
+        elapsed = time.perf_counter() - started
+        size_mb = os.path.getsize(path) / 2**20
+        print(f"✓ Exported {counts['documents']} documents and {counts['chunks']} chunks to {path} "
+              f"({size_mb:.1f} MiB) in {elapsed:.1f}s")
+
+def import_corpus(org_id, path, name=None):
+    app = create_app()
+
+    with app.app_context():
+        ensure_schema()
+        if name:
+            org = Organization(name=name)
+            db.session.add(org)
+            db.session.commit()
+            org_id = org.id
+            print(f"✓ Created organization {name} ({org_id})")
+        elif db.session.get(Organization, org_id) is None:
+            print(f"Organization {org_id} not found")
+            return
+        started = time.perf_counter()
+        with open(path, 'rb') as f:
+            try:
+                result = import_organization(org_id, f)
+            except ValueError as e:
+                db.session.rollback()
+                if name:
+                    db.session.delete(db.session.get(Organization, org_id))
+                    db.session.commit()
+                print(f"Import failed: {e}")
+                return
+        elapsed = time.perf_counter() - started
+        rate = result['imported'] / elapsed if elapsed else 0.0
+        print(f"✓ Imported {result['imported']} documents ({result['chunks']} chunks) in {elapsed:.1f}s "
+              f"({rate:.0f} documents/s), skipped {result['skipped']} already stored")
+        if result['unindexed_chunks']:
+            other_models = [model for model in result['embedding_models'] if model != Config.EMBEDDING_MODEL]
+            print(f"  {result['unindexed_chunks']} chunks have no {Config.EMBEDDING_MODEL} embedding "
+                  f"({', '.join(map(str, other_models)) or 'none'}) and are not searchable until "
+                  f"backfill_embeddings.py re-embeds them")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='write an organization to a file')
+    export_parser.add_argument('org_id', type=int)
+    export_parser.add_argument('path')
+    import_parser = commands.add_parser('import', help='load a file into an organization')
+    import_parser.add_argument('path')
+    target = import_parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--org-id', type=int, help='existing organization to import into')
+    target.add_argument('--new-org', metavar='NAME', help='create an organization to import into')
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_corpus(args.org_id, args.path)
+    else:
+        import_corpus(args.org_id, args.path, args.new_org)
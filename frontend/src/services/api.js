@@ -20,7 +20,18 @@ export const organizationService = {
 // Document API
 export const documentService = {
   upload: (data) => api.post('/documents/upload', data),
-  getAll: (orgId) => api.get(`/documents/?org_id=${orgId}`),
+  // One page of an organization's documents; pass the returned next_cursor to get the next
+  getPage: (orgId, cursor) => api.get('/documents/', { params: { org_id: orgId, limit: 1000, cursor } }),
+  getAll: async (orgId) => {
+    const documents = [];
+    let cursor;
+    do {
+      const response = await documentService.getPage(orgId, cursor);
+      documents.push(...response.data.documents);
+      cursor = response.data.next_cursor;
+    } while (cursor);
+    return { data: { documents } };
+  },
   update: (id, data) => api.put(`/documents/${id}`, data),
   delete: (id) => api.delete(`/documents/${id}`),
   search: (query, orgId) => api.post('/documents/search', { query, org_id: orgId })